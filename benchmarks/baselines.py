@@ -0,0 +1,110 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures the disk size, encode time and decode time of baselines written
+# at each zlib level (huxley -z), for the PNGs under PATH, i.e. a directory
+# of .huxley tests or a screenshot store. Without a PATH it uses generated
+# text-like pages, one screen high and ten screens high.
+#
+#   python benchmarks/baselines.py [PATH] [REPEAT]
+
+import os
+import random
+import sys
+import time
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image, ImageDraw
+
+from huxley.images import encode_baseline, load_image
+
+LEVELS = (1, 3, 6, 9)
+
+
+def make_page(size):
+    "Lines of word-like blocks with the odd colored box, a bit like a web page"
+    random.seed(0)
+    width, height = size
+    im = Image.new('RGBA', size, (255, 255, 255, 255))
+    draw = ImageDraw.Draw(im)
+    for y in xrange(0, height, 18):
+        x = 20
+        while x < width - 80:
+            length = random.randint(10, 60)
+            draw.rectangle([x, y + 4, x + length, y + 14], fill=(random.randint(0, 80),) * 3 + (255,))
+            x += length + 8
+    for _ in xrange(height // 300):
+        y = random.randint(0, height - 100)
+        draw.rectangle([50, y, 300, y + 90], fill=(random.randint(0, 255), random.randint(0, 255), 200, 255))
+    return im
+
+
+def find_pngs(path):
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.png') and not name.startswith(('last', 'diff', '.')):
+                yield os.path.join(root, name)
+
+
+def decode(png):
+    load_image(StringIO(png))
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        func(*args)
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main(path=None, repeat='3'):
+    repeat = int(repeat)
+    if path:
+        originals = []
+        for filename in find_pngs(path):
+            with open(filename, 'rb') as f:
+                originals.append(f.read())
+        images = [load_image(StringIO(png)) for png in originals]
+    else:
+        images = [make_page((1024, 768)), make_page((1024, 7680))]
+        originals = None
+    if not images:
+        print 'No screenshots found in', path
+        return 1
+
+    print '%d screenshots' % len(images)
+    print '%-10s %12s %10s %10s' % ('', 'bytes', 'encode', 'decode')
+    rows = []
+    if originals:
+        rows.append(('as found', originals, 0.0))
+    for level in LEVELS:
+        encoded = []
+        encode = 0.0
+        for im in images:
+            encode += best_of(repeat, encode_baseline, im, level)
+            encoded.append(encode_baseline(im, level))
+        rows.append(('level %d' % level, encoded, encode))
+    for name, pngs, encode in rows:
+        print '%-10s %12d %9.3fs %9.3fs' % (
+            name, sum(len(png) for png in pngs), encode, sum(best_of(repeat, decode, png) for png in pngs)
+        )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
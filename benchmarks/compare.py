@@ -0,0 +1,55 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares two result files written by benchmarks/suite.py and flags
+# results that got slower by more than THRESHOLD (default 1.2, i.e. 20%).
+#
+#   python benchmarks/compare.py OLD NEW [THRESHOLD]
+
+import json
+import sys
+
+
+def key(result):
+    return tuple(sorted((k, v) for k, v in result.items() if k != 'seconds'))
+
+
+def describe(result):
+    return ' '.join(str(v) for k, v in sorted(result.items()) if k not in ('benchmark', 'seconds'))
+
+
+def main(old, new, threshold='1.2'):
+    threshold = float(threshold)
+    with open(old, 'r') as f:
+        old = dict((key(r), r) for r in json.loads(f.read())['results'])
+    with open(new, 'r') as f:
+        new = json.loads(f.read())['results']
+    regressions = 0
+    for result in new:
+        before = old.get(key(result))
+        if before is None or not before['seconds']:
+            continue
+        ratio = result['seconds'] / before['seconds']
+        flag = ''
+        if ratio > threshold:
+            flag = '  SLOWER'
+            regressions += 1
+        print '%-16s %-28s %8.3fs -> %8.3fs  %5.2fx%s' % (
+            result['benchmark'], describe(result), before['seconds'], result['seconds'], ratio, flag
+        )
+    print regressions, 'regressions'
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
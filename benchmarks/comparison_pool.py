@@ -0,0 +1,83 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Simulates `huxley -c CONCURRENCY` comparing failed screenshots, with
+# comparisons run in the test threads and in a shared process pool.
+#
+#   python benchmarks/comparison_pool.py [CONCURRENCY] [SCREENSHOTS] [PROCESSES]
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image
+
+from huxley import threadpool
+from huxley.images import check_screenshot
+
+SIZE = (1920, 1080)
+
+
+def make_screenshots(tmpdir):
+    original = os.path.join(tmpdir, 'screenshot0.png')
+    Image.new('RGBA', SIZE, (240, 240, 240, 255)).save(original)
+    changed = Image.new('RGBA', SIZE, (240, 240, 240, 255))
+    changed.paste((20, 40, 200, 255), (SIZE[0] // 4, SIZE[1] // 4, SIZE[0] // 2, SIZE[1] // 2))
+    f = StringIO()
+    changed.save(f, 'PNG')
+    return original, f.getvalue()
+
+
+def run_test(comparisons, screenshots, original, png):
+    for _ in xrange(screenshots):
+        comparisons.apply(check_screenshot, original, png)
+
+
+def timed(concurrency, screenshots, processes, original, png):
+    comparisons = threadpool.ProcessPool(processes)
+    try:
+        pool = threadpool.ThreadPool()
+        for _ in xrange(concurrency):
+            pool.enqueue(run_test, comparisons, screenshots, original, png)
+        start = time.time()
+        pool.work(concurrency)
+        return time.time() - start
+    finally:
+        comparisons.close()
+
+
+def main(concurrency='8', screenshots='4', processes=None):
+    concurrency = int(concurrency)
+    screenshots = int(screenshots)
+    processes = int(processes or multiprocessing.cpu_count())
+    tmpdir = tempfile.mkdtemp()
+    try:
+        original, png = make_screenshots(tmpdir)
+        total = concurrency * screenshots
+        print '%d tests x %d failed %dx%d screenshots' % (concurrency, screenshots, SIZE[0], SIZE[1])
+        inline = timed(concurrency, screenshots, 0, original, png)
+        print '  in test threads:     %7.2fs  %6.1f comparisons/s' % (inline, total / inline)
+        offloaded = timed(concurrency, screenshots, processes, original, png)
+        print '  in %2d processes:     %7.2fs  %6.1f comparisons/s' % (processes, offloaded, total / offloaded)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,91 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs a generated suite through the huxley command with the fake browser,
+# so everything but the browser is exercised: the scheduler, session pool,
+# comparisons and reporting. Prints how many tests ran per minute.
+#
+#   python benchmarks/fake_suite.py [TESTS] [CONCURRENCY] [PROCESSES] [SCREENSHOTS]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from huxley import cmdline
+from huxley import fileformat
+from huxley.fakedriver import blank_png
+from huxley.images import png_fingerprint
+from huxley.run import Test
+from huxley.steps import ClickTestStep, KeyTestStep, ScreenshotTestStep
+
+SIZE = (1024, 768)
+
+
+def make_suite(tmpdir, tests, screenshots):
+    png = blank_png(SIZE)
+    fingerprint = png_fingerprint(png)
+    sections = []
+    for i in xrange(tests):
+        name = 'test%d' % i
+        path = os.path.join(tmpdir, name + '.huxley')
+        os.makedirs(path)
+        test = Test(SIZE)
+        for index in xrange(screenshots):
+            test.steps.append(ClickTestStep(index * 30, [10, 10]))
+            test.steps.append(KeyTestStep(index * 30 + 10, 'A'))
+            step = ScreenshotTestStep(index * 30 + 20, None, index)
+            step.fingerprint = fingerprint
+            test.steps.append(step)
+            with open(os.path.join(path, 'screenshot%d.png' % index), 'wb') as f:
+                f.write(png)
+        fileformat.dump(test, os.path.join(path, 'record.json'))
+        sections.append('[%s]\nurl=http://localhost/%s\nsleepfactor=0\n' % (name, name))
+    huxleyfile = os.path.join(tmpdir, 'Huxleyfile')
+    with open(huxleyfile, 'w') as f:
+        f.write('\n'.join(sections))
+    return huxleyfile
+
+
+def main(tests='1000', concurrency='4', processes='0', screenshots='3'):
+    tests = int(tests)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        huxleyfile = make_suite(tmpdir, tests, int(screenshots))
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        start = time.time()
+        try:
+            code = cmdline._main(
+                testfile=huxleyfile,
+                browser='fake',
+                playback_only=True,
+                concurrency=int(concurrency),
+                comparison_processes=int(processes),
+                session_uses=tests
+            )
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        seconds = time.time() - start
+        print '%d tests, -c %s -j %s: %.2fs, %d tests/minute, exit code %d' % (
+            tests, concurrency, processes, seconds, tests * 60 / seconds, code
+        )
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,114 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares huxley.images.image_diff against the per-pixel loop it replaced.
+#
+#   python benchmarks/image_diff.py [WIDTHxHEIGHT] [REPEAT]
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image
+
+from huxley.images import image_diff, rmsdiff_2011
+
+
+def legacy_image_diff(path1, path2, outpath, diffcolor):
+    im1 = Image.open(path1)
+    im2 = Image.open(path2)
+
+    rmsdiff = rmsdiff_2011(im1, im2)
+
+    pix1 = im1.load()
+    pix2 = im2.load()
+
+    value = {
+        '1': 255,
+        'L': 255,
+        'RGB': diffcolor,
+        'RGBA': diffcolor + (255,),
+    }[im1.mode]
+
+    width, height = im1.size
+
+    for y in xrange(height):
+        for x in xrange(width):
+            if pix1[x, y] != pix2[x, y]:
+                pix2[x, y] = value
+    im2.save(outpath)
+
+    return (rmsdiff, width, height)
+
+
+def make_pair(tmpdir, size, mode):
+    random.seed(0)
+    base = Image.new('RGB', size, (240, 240, 240))
+    changed = base.copy()
+    width, height = size
+    # Roughly what a moved button looks like: one dense changed block.
+    changed.paste((20, 40, 200), (width // 4, height // 4, width // 2, height // 2))
+    for _ in xrange(1000):
+        changed.putpixel(
+            (random.randrange(width), random.randrange(height)),
+            (random.randrange(256), random.randrange(256), random.randrange(256))
+        )
+    path1 = os.path.join(tmpdir, 'screenshot0.png')
+    path2 = os.path.join(tmpdir, 'last.png')
+    base.convert(mode).save(path1)
+    changed.convert(mode).save(path2)
+    return path1, path2
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        result = func(*args)
+        timings.append(time.time() - start)
+    return min(timings), result
+
+
+def main(size='1920x1080', repeat='3'):
+    size = tuple(int(x) for x in size.split('x'))
+    repeat = int(repeat)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print 'image_diff at %dx%d, best of %d' % (size[0], size[1], repeat)
+        for mode in ('L', 'RGB', 'RGBA'):
+            path1, path2 = make_pair(tmpdir, size, mode)
+            old_time, old_result = best_of(
+                repeat, legacy_image_diff, path1, path2, os.path.join(tmpdir, 'old.png'), (0, 255, 0)
+            )
+            new_time, new_result = best_of(
+                repeat, image_diff, path1, path2, os.path.join(tmpdir, 'new.png'), (0, 255, 0)
+            )
+            same = (
+                old_result == new_result and
+                Image.open(os.path.join(tmpdir, 'old.png')).tobytes() ==
+                Image.open(os.path.join(tmpdir, 'new.png')).tobytes()
+            )
+            print '  %-4s loop %8.3fs  batched %8.3fs  speedup %6.1fx  identical output: %s' % (
+                mode, old_time, new_time, old_time / new_time, same
+            )
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
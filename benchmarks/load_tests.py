@@ -0,0 +1,116 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Times loading a corpus of large record.json files in the jsonpickle format
+# older versions of Huxley wrote and in the current one, and compares with
+# jsonpickle itself if it is installed.
+#
+#   python benchmarks/load_tests.py [TESTS] [STEPS]
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from huxley import fileformat
+from huxley.run import Test
+from huxley.steps import ClickTestStep, KeyTestStep, ScreenshotTestStep
+
+
+def make_test(steps):
+    test = Test((1024, 768))
+    offset_time = 0
+    screenshots = 0
+    for _ in xrange(steps):
+        offset_time += random.randrange(50, 2000)
+        kind = random.random()
+        if kind < 0.1:
+            step = ScreenshotTestStep(offset_time, None, screenshots)
+            step.fingerprint = '%040x' % random.getrandbits(160)
+            screenshots += 1
+        elif kind < 0.4:
+            step = ClickTestStep(offset_time, [random.randrange(1024), random.randrange(768)])
+        else:
+            step = KeyTestStep(offset_time, random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+        test.steps.append(step)
+    return test
+
+
+def legacy_encode(test):
+    "What jsonpickle 0.4 wrote for a Test"
+    steps = []
+    for step in test.steps:
+        d = dict(fileformat.step_to_dict(step))
+        d['py/object'] = 'huxley.steps.' + type(step).__name__
+        del d['type']
+        steps.append(d)
+    return json.dumps({
+        'py/object': 'huxley.run.Test',
+        'screen_size': {'py/tuple': list(test.screen_size)},
+        'steps': steps
+    })
+
+
+def timed(func, paths):
+    start = time.time()
+    for path in paths:
+        func(path)
+    return time.time() - start
+
+
+def main(tests='50', steps='5000'):
+    tests = int(tests)
+    steps = int(steps)
+    random.seed(0)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        current = []
+        legacy = []
+        for i in xrange(tests):
+            test = make_test(steps)
+            path = os.path.join(tmpdir, 'test%d.json' % i)
+            fileformat.dump(test, path)
+            current.append(path)
+            path = os.path.join(tmpdir, 'legacy%d.json' % i)
+            with open(path, 'w') as f:
+                f.write(legacy_encode(test))
+            legacy.append(path)
+
+        print 'Loading %d tests of %d steps' % (tests, steps)
+        try:
+            import jsonpickle
+        except ImportError:
+            print '  (jsonpickle is not installed)'
+        else:
+            def decode(path):
+                with open(path, 'r') as f:
+                    return jsonpickle.decode(f.read())
+            print '  jsonpickle.decode, old files:   %7.2fs' % timed(decode, legacy)
+        print '  fileformat.load, old files:     %7.2fs' % timed(fileformat.load, legacy)
+        print '  fileformat.load:                %7.2fs' % timed(fileformat.load, current)
+
+        def first_step(path):
+            with open(path, 'r') as f:
+                return next(fileformat.iter_steps(f))
+        print '  fileformat.iter_steps, 1 step:  %7.2fs' % timed(first_step, current)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
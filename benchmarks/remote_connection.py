@@ -0,0 +1,110 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Drives SESSIONS concurrent WebDriver sessions against a local stand-in for
+# a grid, each sending COMMANDS commands, once with selenium's own
+# RemoteConnection and once with huxley.remote's keep-alive connection.
+# Prints the time taken and how many TCP connections the server accepted.
+#
+#   python benchmarks/remote_connection.py [SESSIONS] [COMMANDS]
+
+import BaseHTTPServer
+import SocketServer
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from selenium import webdriver
+from selenium.webdriver.remote.remote_connection import RemoteConnection
+
+from huxley.remote import KeepAliveConnection
+
+
+class Grid(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Answers every command the way a browser would, more or less
+    protocol_version = 'HTTP/1.1'
+    # One write per response, flushed by handle_one_request
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        if length:
+            self.rfile.read(length)
+        value = None
+        if self.path.endswith('/session'):
+            value = {'browserName': 'stand-in'}
+        elif self.path.endswith('/execute'):
+            value = []
+        body = json.dumps({'sessionId': 'stand-in', 'status': 0, 'value': value})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_DELETE = respond
+
+
+def session(url, connection, commands):
+    d = webdriver.Remote(connection(url), {'browserName': 'stand-in'})
+    for _ in xrange(commands):
+        d.execute_script('return window._getHuxleyEvents();')
+    d.quit()
+
+
+def run(url, grid, connection, sessions, commands):
+    grid.connections = 0
+    threads = [
+        threading.Thread(target=session, args=(url, connection, commands)) for _ in xrange(sessions)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+    print '%-20s %d sessions x %d commands: %.2fs, %d commands/s, %d connections' % (
+        connection.__name__, sessions, commands, seconds, sessions * commands / seconds, grid.connections
+    )
+
+
+def main(sessions='50', commands='100'):
+    grid = Grid(('127.0.0.1', 0), Handler)
+    threading.Thread(target=grid.serve_forever).start()
+    url = 'http://127.0.0.1:%d/wd/hub' % grid.server_address[1]
+    try:
+        for connection in (RemoteConnection, KeepAliveConnection):
+            run(url, grid, connection, int(sessions), int(commands))
+    finally:
+        grid.shutdown()
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
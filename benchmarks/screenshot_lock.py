@@ -0,0 +1,133 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures concurrent playback throughput when SCREENSHOT_LOCK is held for
+# the whole comparison (as it used to be) and only for the capture.
+#
+#   python benchmarks/screenshot_lock.py [CONCURRENCY] [SCREENSHOTS] [CAPTURE_MS]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image
+
+from huxley import threadpool
+from huxley.consts import TestRunModes
+from huxley.images import Tolerance
+from huxley.run import Test, TestRun
+from huxley.steps import SCREENSHOT_LOCK, ScreenshotTestStep
+
+SIZE = (1920, 1080)
+
+
+class CannedDriver(object):
+    "Just enough of a WebDriver to play back screenshot steps"
+    window_handles = ['main']
+
+    def __init__(self, png, capture_time):
+        self.png = png
+        self.capture_time = capture_time
+
+    def set_window_size(self, width, height):
+        pass
+
+    def get(self, url):
+        pass
+
+    def refresh(self):
+        pass
+
+    def switch_to_window(self, handle):
+        pass
+
+    def get_screenshot_as_png(self):
+        # The browser renders and encodes in another process
+        time.sleep(self.capture_time)
+        return self.png
+
+
+class LockedScreenshotTestStep(ScreenshotTestStep):
+    "Holds SCREENSHOT_LOCK across the comparison, like the old implementation"
+    def execute(self, run):
+        with SCREENSHOT_LOCK:
+            super(LockedScreenshotTestStep, self).execute(run)
+            step, result, _ = run.deferred.pop()
+            step.finish(run, result.get())
+
+
+def make_test(tmpdir, name, step_class, screenshots):
+    path = os.path.join(tmpdir, name)
+    os.makedirs(path)
+    test = Test(SIZE)
+    for index in xrange(screenshots):
+        step = step_class(0, None, index)
+        Image.new('RGBA', SIZE, (240, 240, 240, 255)).save(os.path.join(path, 'screenshot%d.png' % index))
+        test.steps.append(step)
+    return test, path
+
+
+def run_test(test, path, png, capture_time):
+    # Every screenshot changed, but tolerably so: each one pays for a full
+    # comparison without ending the test early.
+    tolerance = Tolerance(max_changed_pixels=SIZE[0] * SIZE[1])
+    run = TestRun(test, path, ('about:blank', None), CannedDriver(png, capture_time),
+                  TestRunModes.PLAYBACK, (0, 255, 0), False, tolerance)
+    run._playback(0)
+
+
+def timed(tmpdir, step_class, concurrency, screenshots, png, capture_time):
+    pool = threadpool.ThreadPool()
+    for i in xrange(concurrency):
+        test, path = make_test(tmpdir, '%s%d' % (step_class.__name__, i), step_class, screenshots)
+        pool.enqueue(run_test, test, path, png, capture_time)
+    start = time.time()
+    pool.work(concurrency)
+    return time.time() - start
+
+
+def main(concurrency='8', screenshots='3', capture_ms='200'):
+    concurrency = int(concurrency)
+    screenshots = int(screenshots)
+    capture_time = float(capture_ms) / 1000
+    changed = Image.new('RGBA', SIZE, (240, 240, 240, 255))
+    changed.paste((20, 40, 200, 255), (SIZE[0] // 4, SIZE[1] // 4, SIZE[0] // 2, SIZE[1] // 2))
+    f = StringIO()
+    changed.save(f, 'PNG')
+    png = f.getvalue()
+
+    tmpdir = tempfile.mkdtemp()
+    # Playback prints every step; keep the results readable.
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        locked = timed(tmpdir, LockedScreenshotTestStep, concurrency, screenshots, png, capture_time)
+        unlocked = timed(tmpdir, ScreenshotTestStep, concurrency, screenshots, png, capture_time)
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(tmpdir)
+
+    total = concurrency * screenshots
+    print '%d tests x %d changed %dx%d screenshots, %dms per capture' % (
+        concurrency, screenshots, SIZE[0], SIZE[1], capture_time * 1000
+    )
+    print '  lock held for comparison: %7.2fs  %6.1f screenshots/s' % (locked, total / locked)
+    print '  lock held for capture:    %7.2fs  %6.1f screenshots/s' % (unlocked, total / unlocked)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
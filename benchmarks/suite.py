@@ -0,0 +1,200 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Times Huxley's hot paths and writes the results as JSON, so runs on
+# different commits can be compared:
+#
+#  * images_identical, rmsdiff_2011 and image_diff for every combination of
+#    image size, mode (RGB, RGBA, L and P) and fraction of changed pixels
+#  * loading record.json, in the current and the old jsonpickle format
+#  * TestRun._playback against huxley.fakedriver, i.e. Huxley's own overhead
+#    per step
+#
+#   python benchmarks/suite.py [OUTPUT] [SIZES] [REPEAT]
+#
+# SIZES is comma-separated (default 1024x768,1920x1080,3840x2160) and each
+# result is the best of REPEAT runs (default 3). Results go to stdout unless
+# OUTPUT is given; progress goes to stderr.
+
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import PIL
+from PIL import Image
+
+from huxley import fileformat
+from huxley.fakedriver import FakeDriver, blank_png
+from huxley.consts import TestRunModes
+from huxley.images import image_diff, images_identical, png_fingerprint, rmsdiff_2011
+from huxley.run import Test, TestRun
+from huxley.steps import ClickTestStep, KeyTestStep, ScreenshotTestStep
+from huxley.version import __version__
+
+from load_tests import legacy_encode, make_test
+
+MODES = ('RGB', 'RGBA', 'L', 'P')
+DENSITIES = (0.0, 0.01, 0.1, 0.5, 1.0)
+BACKGROUND = (240, 240, 240)
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        func(*args)
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def make_pair(tmpdir, size, mode, density):
+    "Save a baseline and a screenshot with the given fraction of its pixels changed"
+    width, height = size
+    base = Image.new('RGB', size, BACKGROUND)
+    changed = base.copy()
+    # Whole rows, so density is exact; some noise so PNGs aren't trivial.
+    rows = int(round(height * density))
+    if rows:
+        changed.paste((20, 40, 200), (0, 0, width, rows))
+    random.seed(0)
+    for _ in xrange(200):
+        xy = (random.randrange(width), random.randrange(height))
+        color = (random.randrange(256), random.randrange(256), random.randrange(256))
+        base.putpixel(xy, color)
+        if xy[1] >= rows:
+            changed.putpixel(xy, color)
+    if mode == 'P':
+        # Both images have to share a palette for rmsdiff_2011 to mean much
+        palette = base.convert('P', palette=Image.ADAPTIVE, colors=255)
+        base = base.quantize(palette=palette)
+        changed = changed.quantize(palette=palette)
+    else:
+        base = base.convert(mode)
+        changed = changed.convert(mode)
+    path1 = os.path.join(tmpdir, 'screenshot0.png')
+    path2 = os.path.join(tmpdir, 'last.png')
+    base.save(path1)
+    changed.save(path2)
+    return path1, path2
+
+
+def decoded_rmsdiff(path1, path2):
+    return rmsdiff_2011(Image.open(path1), Image.open(path2))
+
+
+def bench_images(tmpdir, sizes, repeat, results):
+    outpath = os.path.join(tmpdir, 'diff.png')
+    for size in sizes:
+        for mode in MODES:
+            for density in DENSITIES:
+                path1, path2 = make_pair(tmpdir, size, mode, density)
+                for name, func, args in (
+                    ('images_identical', images_identical, (path1, path2)),
+                    ('rmsdiff_2011', decoded_rmsdiff, (path1, path2)),
+                    ('image_diff', image_diff, (path1, path2, outpath, (0, 255, 0))),
+                ):
+                    seconds = best_of(repeat, func, *args)
+                    results.append({
+                        'benchmark': name,
+                        'size': '%dx%d' % size,
+                        'mode': mode,
+                        'density': density,
+                        'seconds': seconds
+                    })
+                    print >>sys.stderr, '  %-16s %9s %-4s %4d%% changed %8.3fs' % (
+                        name, '%dx%d' % size, mode, density * 100, seconds
+                    )
+
+
+def bench_load(tmpdir, repeat, results, steps=5000):
+    random.seed(0)
+    test = make_test(steps)
+    current = os.path.join(tmpdir, 'record.json')
+    legacy = os.path.join(tmpdir, 'legacy.json')
+    fileformat.dump(test, current)
+    with open(legacy, 'w') as f:
+        f.write(legacy_encode(test))
+    for name, path in (('load', current), ('load legacy', legacy)):
+        seconds = best_of(repeat, fileformat.load, path)
+        results.append({'benchmark': name, 'steps': steps, 'seconds': seconds})
+        print >>sys.stderr, '  %-16s %d steps %8.3fs' % (name, steps, seconds)
+
+
+def bench_playback(tmpdir, repeat, results, steps=2000, screenshots=20):
+    # The fake driver shows a blank page, so that's every baseline
+    png = blank_png((1024, 768))
+    test = Test((1024, 768))
+    index = 0
+    for i in xrange(steps):
+        if i % (steps // screenshots) == 0:
+            step = ScreenshotTestStep(i, None, index)
+            index += 1
+            step.fingerprint = png_fingerprint(png)
+            with open(os.path.join(tmpdir, 'screenshot%d.png' % step.index), 'wb') as baseline:
+                baseline.write(png)
+        elif i % 3:
+            step = KeyTestStep(i, 'A')
+        else:
+            step = ClickTestStep(i, [10, 10])
+        test.steps.append(step)
+
+    def playback():
+        run = TestRun(test, tmpdir, ('about:blank', None), FakeDriver(), TestRunModes.PLAYBACK, (0, 255, 0), False)
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            run._playback(0)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    seconds = best_of(repeat, playback)
+    results.append({'benchmark': 'playback', 'steps': steps, 'screenshots': screenshots, 'seconds': seconds})
+    print >>sys.stderr, '  %-16s %d steps %8.3fs  %.1fus per step' % ('playback', steps, seconds, seconds / steps * 1e6)
+
+
+def main(output=None, sizes='1024x768,1920x1080,3840x2160', repeat='3'):
+    sizes = [tuple(int(x) for x in size.split('x')) for size in sizes.split(',')]
+    repeat = int(repeat)
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bench_images(tmpdir, sizes, repeat, results)
+        bench_load(tmpdir, repeat, results)
+        bench_playback(tmpdir, repeat, results)
+    finally:
+        shutil.rmtree(tmpdir)
+    report = json.dumps({
+        'huxley': __version__,
+        'python': platform.python_version(),
+        'pillow': getattr(PIL, 'PILLOW_VERSION', None),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'repeat': repeat,
+        'results': results
+    }, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(report)
+    else:
+        print report
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,89 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Measures the time and peak memory of comparing a generated page against a
+# copy with a box painted over it, at growing page heights, a strip at a
+# time and decoded whole. Each comparison runs in a process of its own so
+# that peak memory is its own.
+#
+#   python benchmarks/tall_pages.py [HEIGHT ...]
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from huxley import images
+
+from baselines import make_page
+
+HEIGHTS = (768, 5000, 20000, 40000)
+WIDTH = 1024
+
+
+def make_pair(directory, height):
+    im = make_page((WIDTH, height))
+    original = os.path.join(directory, 'original%d.png' % height)
+    im.save(original)
+    im.paste((255, 0, 0, 255), (100, height // 2, 400, height // 2 + 50))
+    changed = os.path.join(directory, 'changed%d.png' % height)
+    im.save(changed)
+    return original, changed
+
+
+def compare(original, changed, diffpath, strip_threshold):
+    "Run in a process of its own; prints seconds and peak RSS growth in KB"
+    images.STRIP_THRESHOLD = int(strip_threshold)
+    with open(changed, 'rb') as f:
+        png = f.read()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    images.check_screenshot(original, png, diffpath=diffpath, diffcolor=(0, 255, 0))
+    print time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+
+def measure(original, changed, diffpath, strip_threshold):
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--compare', original, changed, diffpath, str(strip_threshold)]
+    )
+    seconds, kilobytes = output.split()
+    return float(seconds), int(kilobytes) // 1024
+
+
+def main(*heights):
+    heights = [int(height) for height in heights] or HEIGHTS
+    directory = tempfile.mkdtemp()
+    try:
+        print '%8s %18s %18s' % ('height', 'in strips', 'whole')
+        for height in heights:
+            original, changed = make_pair(directory, height)
+            diffpath = os.path.join(directory, 'diff.png')
+            strips = measure(original, changed, diffpath, 0)
+            whole = measure(original, changed, diffpath, WIDTH * height)
+            print '%8d %8.2fs %6d MB %8.2fs %6d MB' % ((height,) + strips + whole)
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--compare']:
+        compare(*sys.argv[2:])
+    else:
+        sys.exit(main(*sys.argv[1:]))
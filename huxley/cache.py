@@ -0,0 +1,125 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# What Huxley remembers about tests between runs: which tests passed with
+# which inputs, so unchanged tests can be skipped, and how long each test
+# took, so the slowest can be started first. A test's inputs are its
+# Huxleyfile section, its .huxley directory (record.json and baseline
+# screenshots), its POST data, a fingerprint of the assets it is served
+# from and the browser and WebDriver server it is played back on.
+
+import hashlib
+import json
+import os
+import threading
+
+from huxley.version import __version__
+
+
+def test_key(file, testname):
+    "What a test is remembered by: its Huxleyfile and section"
+    return file + ':' + testname
+
+
+def hash_path(path, h=None):
+    "Hash a file, or every file under a directory, by name and contents"
+    h = h or hashlib.sha1()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                filename = os.path.join(root, name)
+                h.update(os.path.relpath(filename, path) + '\0')
+                with open(filename, 'rb') as f:
+                    h.update(f.read())
+    else:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h
+
+
+def assets_fingerprint(assets):
+    "Use a directory's contents as the fingerprint, or any other string as is"
+    if assets and os.path.isdir(assets):
+        return hash_path(assets).hexdigest()
+    return assets
+
+
+def test_fingerprint(test_config, filename, postdata, assets, baselines=None, browser=None, remote=None):
+    """
+    Fingerprint a test's inputs, or return None if they can't be known
+    ahead of time. baselines is the directory of a huxley.matrix variant's
+    screenshots, if it doesn't use the test's own; browser and remote are
+    what it is played back on.
+    """
+    if postdata == '-' or not os.path.isdir(filename):
+        return None
+    if baselines and not os.path.isdir(baselines):
+        return None
+    h = hashlib.sha1()
+    h.update(json.dumps([__version__, sorted(test_config.items()), assets, browser, remote]))
+    for path in filter(None, [filename, baselines]):
+        for name in sorted(os.listdir(path)):
+            # Everything else is output from earlier runs
+            if name == 'record.json' or (name.startswith('screenshot') and name.endswith('.png')):
+                h.update(os.path.relpath(os.path.join(path, name), filename) + '\0')
+                hash_path(os.path.join(path, name), h)
+    if postdata:
+        hash_path(postdata, h)
+    return h.hexdigest()
+
+
+class JSONStore(object):
+    "A dict kept in a JSON file between runs, safe to use from several threads"
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                self.data = json.loads(f.read())
+        except (IOError, ValueError):
+            self.data = {}
+
+    def save(self):
+        with self.lock:
+            with open(self.path, 'w') as f:
+                f.write(json.dumps(self.data, indent=2, sort_keys=True))
+
+
+class TestCache(JSONStore):
+    def is_unchanged(self, key, fingerprint):
+        with self.lock:
+            return fingerprint is not None and self.data.get(key) == fingerprint
+
+    def set_passed(self, key, fingerprint):
+        with self.lock:
+            if fingerprint is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = fingerprint
+
+    def set_failed(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+
+class Durations(JSONStore):
+    "How many seconds each test took the last time it ran"
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def set(self, key, seconds):
+        with self.lock:
+            self.data[key] = round(seconds, 3)
@@ -18,34 +18,100 @@ import json
 import os
 import sys
 import threading
+import time
 
 import plac
 
+from huxley.consts import ExitCodes
+from huxley.errors import TestError
 from huxley.main import main as huxleymain
+from huxley import cache as testcache
+from huxley import fileformat
+from huxley import images
+from huxley import matrix
+from huxley import sessions
+from huxley import shards
+from huxley import steps
+from huxley.store import get_store_path
 from huxley import threadpool
+from huxley import timing
 from huxley.version import __version__
 
-class ExitCodes(object):
-    OK = 0
-    NEW_SCREENSHOTS = 1
-    ERROR = 2
-
 LOCAL_WEBDRIVER_URL = os.environ.get('HUXLEY_WEBDRIVER_LOCAL', 'http://localhost:4444/wd/hub')
 REMOTE_WEBDRIVER_URL = os.environ.get('HUXLEY_WEBDRIVER_REMOTE', 'http://localhost:4444/wd/hub')
 DEFAULTS = json.loads(os.environ.get('HUXLEY_DEFAULTS', 'null'))
 
-def run_test(record, playback_only, save_diff, new_screenshots, file, config, testname):
-    print '[' + testname + '] Running test:', testname
-    test_config = dict(config.items(testname))
-    url = config.get(testname, 'url')
+def get_filename(file, test_config, testname):
     default_filename = os.path.join(
         os.path.dirname(file),
         testname + '.huxley'
     )
-    filename = test_config.get(
+    return test_config.get(
         'filename',
         default_filename
     )
+
+def get_name(testname, variant):
+    "What a test is called in output and remembered by, i.e. toggle (chrome-375x667)"
+    if variant.name is None:
+        return testname
+    return '%s (%s)' % (testname, variant.name)
+
+def get_cost(durations, file, config, testname, variant):
+    """
+    How many seconds a test is expected to take: as long as it took last
+    time, or as long as its recording for a test that hasn't run before.
+    """
+    if durations:
+        seconds = durations.get(testcache.test_key(file, get_name(testname, variant)))
+        if seconds is not None:
+            return seconds
+    test_config = dict(config.items(testname))
+    try:
+        test = fileformat.load(os.path.join(get_filename(file, test_config, testname), 'record.json'))
+    except (IOError, ValueError, KeyError):
+        return 0.0
+    if not test.steps:
+        return 0.0
+    return test.steps[-1].offset_time * float(test_config.get('sleepfactor', 1.0)) / 1000
+
+def run_test(report, durations, queued_at, record, playback_only, save_diff, tune_sleepfactor, fast,
+             keep_going, cache, assets, new_screenshots, file, config, testname, variant):
+    name = get_name(testname, variant)
+    if report:
+        report.start_test(file, name, time.time() - queued_at)
+    start = time.time()
+    result = 'error'
+    message = None
+    try:
+        result = _run_test(
+            record, playback_only, save_diff, tune_sleepfactor, fast, keep_going, cache, assets,
+            new_screenshots, file, config, testname, variant
+        )
+    except TestError as e:
+        # i.e. a different screenshot with --playback-only, as opposed to
+        # the test itself breaking
+        result = 'failed'
+        message = str(e)
+        raise
+    finally:
+        if report:
+            report.finish_test(result, message)
+    # Tuning plays tests back many times over, so it says little about
+    # how long they take.
+    if durations and not record and not tune_sleepfactor and result in ('passed', 'new screenshots'):
+        durations.set(testcache.test_key(file, name), time.time() - start)
+
+def _run_test(record, playback_only, save_diff, tune_sleepfactor, fast, keep_going, cache, assets,
+              new_screenshots, file, config, testname, variant):
+    test_config = dict(config.items(testname))
+    url = config.get(testname, 'url')
+    filename = get_filename(file, test_config, testname)
+    name = get_name(testname, variant)
+    store = get_store_path(file, test_config)
+    baselines = None
+    if variant.name is not None:
+        baselines = matrix.get_path(filename, variant)
     sleepfactor = float(test_config.get(
         'sleepfactor',
         1.0
@@ -53,36 +119,87 @@ def run_test(record, playback_only, save_diff, new_screenshots, file, config, te
     postdata = test_config.get(
         'postdata'
     )
-    screensize = test_config.get(
-        'screensize',
-        '1024x768'
+    pixelthreshold = int(test_config.get(
+        'pixelthreshold',
+        0
+    ))
+    maxchangedpixels = test_config.get(
+        'maxchangedpixels'
+    )
+    if maxchangedpixels is not None:
+        maxchangedpixels = int(maxchangedpixels)
+    maxrms = test_config.get(
+        'maxrms'
+    )
+    if maxrms is not None:
+        maxrms = float(maxrms)
+    include = test_config.get(
+        'include'
     )
+    ignore = test_config.get(
+        'ignore'
+    )
+    cache_key = testcache.test_key(file, name)
+    fingerprint = None
+    # Tuning runs every test whatever the cache says, and leaves it as it was
+    if cache and not record and not tune_sleepfactor:
+        fingerprint = testcache.test_fingerprint(
+            test_config, filename, postdata, assets, baselines, variant.browser, REMOTE_WEBDRIVER_URL
+        )
+        if cache.is_unchanged(cache_key, fingerprint):
+            print '[' + name + '] Skipping unchanged test:', name
+            return 'skipped'
+    print '[' + name + '] Running test:', name
     if record:
         r = huxleymain(
-            testname,
+            name,
             url,
             filename,
             postdata,
             local=LOCAL_WEBDRIVER_URL,
             remote=REMOTE_WEBDRIVER_URL,
             record=True,
-            screensize=screensize
+            browser=variant.browser,
+            screensize=variant.screensize,
+            pixelthreshold=pixelthreshold,
+            maxchangedpixels=maxchangedpixels,
+            maxrms=maxrms,
+            include=include,
+            ignore=ignore,
+            store=store
         )
     else:
         r = huxleymain(
-            testname,
+            name,
             url,
             filename,
             postdata,
             remote=REMOTE_WEBDRIVER_URL,
             sleepfactor=sleepfactor,
-            autorerecord=not playback_only,
+            browser=variant.browser,
+            autorerecord=not playback_only and not tune_sleepfactor,
+            tune_sleepfactor=tune_sleepfactor,
             save_diff=save_diff,
-            screensize=screensize
+            fast=fast,
+            keep_going=keep_going,
+            screensize=variant.screensize,
+            pixelthreshold=pixelthreshold,
+            maxchangedpixels=maxchangedpixels,
+            maxrms=maxrms,
+            include=include,
+            ignore=ignore,
+            baselines=baselines,
+            store=store
         )
     print
     if r != 0:
         new_screenshots.set_value(True)
+    if cache and not record and not tune_sleepfactor:
+        if r == 0:
+            cache.set_passed(cache_key, fingerprint)
+        else:
+            cache.set_failed(cache_key)
+    return 'passed' if r == 0 else 'new screenshots'
 
 @plac.annotations(
     names=plac.Annotation(
@@ -105,6 +222,13 @@ def run_test(record, playback_only, save_diff, new_screenshots, file, config, te
         'flag',
         'p'
     ),
+    browser=plac.Annotation(
+        'Browser to use, either firefox, chrome, phantomjs, ie, opera or fake',
+        'option',
+        'b',
+        str,
+        metavar='NAME'
+    ),
     concurrency=plac.Annotation(
         'Number of tests to run in parallel',
         'option',
@@ -112,11 +236,89 @@ def run_test(record, playback_only, save_diff, new_screenshots, file, config, te
         int,
         metavar='NUMBER'
     ),
+    comparison_processes=plac.Annotation(
+        'Number of worker processes to compare screenshots in (default: compare in each test\'s thread)',
+        'option',
+        'j',
+        int,
+        metavar='NUMBER'
+    ),
+    session_uses=plac.Annotation(
+        'Number of tests to run in each browser session before starting a new one',
+        'option',
+        'u',
+        int,
+        metavar='NUMBER'
+    ),
     save_diff=plac.Annotation(
-        'Save information about failures as last.png and diff.png',
+        'Save information about failures as last.png and diff.png, or as lastN.png and diffN.png for screenshot N when every screenshot is compared (i.e. --keep-going or autorerecord)',
         'flag',
         'e'
     ),
+    tune_sleepfactor=plac.Annotation(
+        'Find and save the smallest sleep factor each test passes with',
+        'flag',
+        'T'
+    ),
+    fast=plac.Annotation(
+        'Run each step as soon as the page settles rather than after the recorded delay',
+        'flag',
+        'F'
+    ),
+    keep_going=plac.Annotation(
+        'Compare every screenshot instead of stopping at the first difference',
+        'flag',
+        'K'
+    ),
+    cache=plac.Annotation(
+        'Skip tests whose inputs are unchanged since they last passed, remembering passes in FILE',
+        'option',
+        'k',
+        str,
+        metavar='FILE'
+    ),
+    assets=plac.Annotation(
+        'Fingerprint of the assets tests are served from, or a directory to hash for one (used with --cache)',
+        'option',
+        'a',
+        str,
+        metavar='FINGERPRINT'
+    ),
+    shard_index=plac.Annotation(
+        'Only run the tests in this shard, from 0 to the shard count minus one (see huxley-merge)',
+        'option',
+        'X',
+        int,
+        metavar='NUMBER'
+    ),
+    shard_count=plac.Annotation(
+        'Split the tests of every Huxleyfile into this many shards of about the same duration',
+        'option',
+        'N',
+        int,
+        metavar='NUMBER'
+    ),
+    durations=plac.Annotation(
+        'Remember how long each test took in FILE, to start the slowest tests first next time',
+        'option',
+        'd',
+        str,
+        metavar='FILE'
+    ),
+    report=plac.Annotation(
+        'Write how long each test and step took to FILE, as JUnit XML if it ends in .xml and JSON otherwise',
+        'option',
+        'o',
+        str,
+        metavar='FILE'
+    ),
+    compress_level=plac.Annotation(
+        'zlib level to write new screenshots at, from 1 (fastest to decode) to 9 (smallest, the default)',
+        'option',
+        'z',
+        int,
+        metavar='NUMBER'
+    ),
     version=plac.Annotation(
         'Get the current version',
         'flag',
@@ -128,8 +330,21 @@ def _main(
     testfile='Huxleyfile',
     record=False,
     playback_only=False,
+    browser='firefox',
     concurrency=1,
+    comparison_processes=0,
+    session_uses=1,
     save_diff=False,
+    tune_sleepfactor=False,
+    fast=False,
+    keep_going=False,
+    cache=None,
+    assets=None,
+    shard_index=0,
+    shard_count=1,
+    durations=None,
+    report=None,
+    compress_level=images.BASELINE_COMPRESS_LEVEL,
     version=False
 ):
     if version:
@@ -140,10 +355,30 @@ def _main(
     if len(testfiles) == 0:
         print 'no Huxleyfile found'
         return ExitCodes.ERROR
+    if not 0 <= shard_index < shard_count:
+        print 'shard index must be from 0 to %d' % (shard_count - 1)
+        return ExitCodes.ERROR
+
+    if not 1 <= compress_level <= 9:
+        print 'compress level must be from 1 to 9'
+        return ExitCodes.ERROR
 
+    images.BASELINE_COMPRESS_LEVEL = compress_level
     new_screenshots = threadpool.Flag()
     pool = threadpool.ThreadPool()
+    # Fork the comparison workers before any test threads exist
+    steps.COMPARISON_POOL = threadpool.ProcessPool(comparison_processes)
+    sessions.POOL = sessions.SessionPool(session_uses)
+    if cache:
+        cache = testcache.TestCache(cache)
+        assets = testcache.assets_fingerprint(assets)
+    if durations:
+        durations = testcache.Durations(durations)
+    report_path = report
+    if report_path:
+        report = timing.Report((shard_index, shard_count) if shard_count > 1 else None)
 
+    tests = []
     for file in testfiles:
         msg = 'Running Huxley file: ' + file
         print '-' * len(msg)
@@ -158,9 +393,55 @@ def _main(
         for testname in config.sections():
             if names and (testname not in names):
                 continue
-            pool.enqueue(run_test, record, playback_only, save_diff, new_screenshots, file, config, testname)
+            test_config = dict(config.items(testname))
+            variants = matrix.variants(
+                test_config.get('browsers') or browser,
+                test_config.get('screensize') or '1024x768'
+            )
+            # Only the first variant is recorded; the others take their
+            # screenshots on their first playback.
+            if record:
+                variants = variants[:1]
+            for variant in variants:
+                # Longest first, when there's more than one test at a time
+                # or shards to balance
+                if concurrency > 1 or shard_count > 1:
+                    cost = get_cost(durations, file, config, testname, variant)
+                else:
+                    cost = 0
+                key = testcache.test_key(file, get_name(testname, variant))
+                tests.append((key, cost, (file, config, testname, variant)))
 
-    pool.work(concurrency)
+    if shard_count > 1:
+        count = len(tests)
+        shard = set(shards.partition(tests, shard_count)[shard_index])
+        tests = [test for test in tests if test[2] in shard]
+        print 'Running shard %d of %d: %d of %d tests' % (shard_index, shard_count, len(tests), count)
+
+    for key, cost, (file, config, testname, variant) in tests:
+        pool.enqueue_with_cost(
+            cost, run_test, report, durations, time.time(), record, playback_only, save_diff,
+            tune_sleepfactor, fast, keep_going, cache, assets, new_screenshots, file, config, testname, variant
+        )
+
+    try:
+        pool.work(concurrency)
+    finally:
+        steps.COMPARISON_POOL.close()
+        steps.COMPARISON_POOL = threadpool.ProcessPool()
+        sessions.POOL.close()
+        sessions.POOL = sessions.SessionPool()
+        if cache:
+            cache.save()
+        if durations:
+            durations.save()
+        if report_path:
+            report = report.to_dict()
+            timing.write(report, report_path)
+            timing.print_summary(report)
+    if pool.errors:
+        print '** %d test(s) raised an error; see above. **' % len(pool.errors)
+        return ExitCodes.ERROR
     if new_screenshots.value:
         print '** New screenshots were written; please verify that they are correct. **'
         return ExitCodes.NEW_SCREENSHOTS
@@ -16,3 +16,8 @@ class TestRunModes(object):
     RECORD = 1
     RERECORD = 2
     PLAYBACK = 3
+
+class ExitCodes(object):
+    OK = 0
+    NEW_SCREENSHOTS = 1
+    ERROR = 2
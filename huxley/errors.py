@@ -1,2 +1,9 @@
 class TestError(RuntimeError):
     pass
+
+
+class ScreenshotsDifferentError(TestError):
+    "Raised at the end of a keep-going playback with the run that failed"
+    def __init__(self, message, run):
+        super(ScreenshotsDifferentError, self).__init__(message)
+        self.run = run
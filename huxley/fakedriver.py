@@ -0,0 +1,121 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# An in-process stand-in for a WebDriver browser (huxley -b fake), for
+# trying out Huxley itself without Selenium or a browser: dry runs,
+# load-testing the scheduler and comparisons, and measuring Huxley's own
+# overhead.
+#
+# It implements just what Huxley uses. Screenshots are the PNGs in
+# $HUXLEY_FAKE_SCREENSHOTS, served in sorted order and starting over at
+# each page load, or blank pages the size of the window if it isn't set.
+
+import os
+import threading
+import time
+from cStringIO import StringIO
+
+from PIL import Image
+
+SCREENSHOTS = os.environ.get('HUXLEY_FAKE_SCREENSHOTS')
+
+_blank_lock = threading.Lock()
+_blank = {}
+
+
+def blank_png(size):
+    with _blank_lock:
+        if size not in _blank:
+            f = StringIO()
+            Image.new('RGB', size, (255, 255, 255)).save(f, 'PNG')
+            _blank[size] = f.getvalue()
+        return _blank[size]
+
+
+class FakeElement(object):
+    def __init__(self, driver):
+        self.driver = driver
+
+    def click(self):
+        pass
+
+    def send_keys(self, keys):
+        self.driver.keys.append(keys)
+
+
+class FakeDriver(object):
+    window_handles = ['fake']
+
+    def __init__(self, screenshots=None):
+        self.screenshots = []
+        directory = screenshots or SCREENSHOTS
+        if directory:
+            self.screenshots = [
+                os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.png')
+            ]
+        self.size = (1024, 768)
+        self.url = 'about:blank'
+        self.taken = 0
+        # Everything typed, for anyone inspecting the driver
+        self.keys = []
+
+    def get(self, url):
+        self.url = url
+        self.taken = 0
+
+    def refresh(self):
+        self.taken = 0
+
+    def set_window_size(self, width, height):
+        self.size = (width, height)
+
+    def switch_to_window(self, handle):
+        pass
+
+    def execute_script(self, script):
+        # Answer the few questions Huxley asks of the page
+        if 'activeElement' in script:
+            return FakeElement(self)
+        if '_getHuxleyEvents()' in script:
+            return []
+        if '_huxleyIsQuiet' in script:
+            return True
+        if 'Date' in script:
+            return int(time.time() * 1000)
+        return None
+
+    def find_element_by_id(self, id):
+        return FakeElement(self)
+
+    def get_screenshot_as_png(self):
+        if not self.screenshots:
+            return blank_png(self.size)
+        path = self.screenshots[self.taken % len(self.screenshots)]
+        self.taken += 1
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def save_screenshot(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.get_screenshot_as_png())
+        return True
+
+    def delete_all_cookies(self):
+        pass
+
+    def close(self):
+        pass
+
+    def quit(self):
+        pass
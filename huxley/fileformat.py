@@ -0,0 +1,191 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# record.json is plain, versioned JSON with one step per line:
+#
+#   {"version": 1, "screen_size": [1024, 768], "steps": [
+#   {"type": "screenshot", "offset_time": 2619, "index": 0, "fingerprint": "..."},
+#   {"type": "click", "offset_time": 4864, "pos": [116, 79]},
+#   {"type": "key", "offset_time": 5012, "key": "A"}
+#   ]}
+#
+# Because of that layout, steps can be read one line at a time without
+# parsing the whole file. Files written by older versions of Huxley with
+# jsonpickle are still read, without importing anything they name.
+
+import collections
+import json
+import os
+import sys
+import threading
+
+import plac
+
+from huxley.images import fingerprint, load_image
+from huxley.run import Test
+from huxley.steps import ClickTestStep, KeyTestStep, ScreenshotTestStep
+
+VERSION = 1
+
+HEADER = '{"version": %d, "screen_size": %s, "steps": [\n'
+FOOTER = ']}\n'
+
+LEGACY_TYPES = {
+    'huxley.steps.ScreenshotTestStep': 'screenshot',
+    'huxley.steps.ClickTestStep': 'click',
+    'huxley.steps.KeyTestStep': 'key',
+}
+
+
+def step_to_dict(step):
+    d = collections.OrderedDict()
+    if isinstance(step, ScreenshotTestStep):
+        d['type'] = 'screenshot'
+        d['offset_time'] = step.offset_time
+        d['index'] = step.index
+        for attr in ('fingerprint', 'include', 'ignore'):
+            if getattr(step, attr) is not None:
+                d[attr] = getattr(step, attr)
+    elif isinstance(step, ClickTestStep):
+        d['type'] = 'click'
+        d['offset_time'] = step.offset_time
+        d['pos'] = list(step.pos)
+    elif isinstance(step, KeyTestStep):
+        d['type'] = 'key'
+        d['offset_time'] = step.offset_time
+        d['key'] = step.key
+    else:
+        raise ValueError('Unknown step %r' % step)
+    return d
+
+
+def step_from_dict(d):
+    type = d.get('type')
+    if type == 'screenshot':
+        step = ScreenshotTestStep(d['offset_time'], None, d['index'])
+        step.fingerprint = d.get('fingerprint')
+        step.include = d.get('include')
+        step.ignore = d.get('ignore')
+        return step
+    elif type == 'click':
+        return ClickTestStep(d['offset_time'], d['pos'])
+    elif type == 'key':
+        return KeyTestStep(d['offset_time'], d['key'])
+    raise ValueError('Unknown step type %r' % type)
+
+
+def _from_legacy(d):
+    "Convert a test written by jsonpickle into the current format"
+    steps = []
+    for step in d.get('steps', []):
+        step = dict(step)
+        step['type'] = LEGACY_TYPES.get(step.pop('py/object', None))
+        steps.append(step)
+    screen_size = d['screen_size']
+    if isinstance(screen_size, dict):
+        screen_size = screen_size['py/tuple']
+    return {'version': VERSION, 'screen_size': screen_size, 'steps': steps}
+
+
+def _check_version(d):
+    if d.get('version') > VERSION:
+        raise ValueError('record.json version %r is newer than this version of Huxley' % d.get('version'))
+
+
+def _from_dict(d):
+    if 'py/object' in d:
+        d = _from_legacy(d)
+    _check_version(d)
+    test = Test(tuple(d['screen_size']))
+    test.steps = [step_from_dict(step) for step in d['steps']]
+    return test
+
+
+def iter_steps(f):
+    """
+    Yield the steps of an open record.json one at a time, parsing one line
+    per step. Older files, and any not laid out like dump's, are parsed
+    whole.
+    """
+    header = f.readline()
+    try:
+        d = json.loads(header + FOOTER) if header.startswith('{"version": ') else None
+    except ValueError:
+        d = None
+    if d is None:
+        for step in _from_dict(json.loads(header + f.read())).steps:
+            yield step
+        return
+    _check_version(d)
+    for line in f:
+        line = line.rstrip().rstrip(',')
+        if line == ']}':
+            return
+        yield step_from_dict(json.loads(line))
+
+
+def loads(data):
+    return _from_dict(json.loads(data))
+
+
+def load(path):
+    with open(path, 'r') as f:
+        return loads(f.read())
+
+
+def dumps(test):
+    lines = [json.dumps(step_to_dict(step)) for step in test.steps]
+    return (
+        HEADER % (VERSION, json.dumps(list(test.screen_size))) +
+        ''.join(line + ',\n' for line in lines[:-1]) +
+        ''.join(line + '\n' for line in lines[-1:]) +
+        FOOTER
+    )
+
+
+def dump(test, path):
+    # Written aside and renamed so other variants of the test, which read
+    # it concurrently, never see half a file. The name is unique to this
+    # thread so it can be opened as usual, with the usual permissions.
+    tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+    with open(tmp, 'w') as f:
+        f.write(dumps(test))
+    os.rename(tmp, path)
+
+
+def add_fingerprints(test, path):
+    """
+    Fingerprint the screenshot steps of a test that have none yet from
+    their baselines in path, so playback can accept unchanged screenshots
+    without rerecording the test first.
+    """
+    for step in test.steps:
+        if isinstance(step, ScreenshotTestStep) and step.fingerprint is None:
+            baseline = os.path.join(path, 'screenshot%d.png' % step.index)
+            if os.path.exists(baseline):
+                step.fingerprint = fingerprint(load_image(baseline))
+
+
+@plac.annotations(
+    paths=plac.Annotation('record.json files to rewrite in the current format')
+)
+def migrate(*paths):
+    for path in paths:
+        test = load(path)
+        add_fingerprints(test, os.path.dirname(path))
+        dump(test, path)
+        print 'Migrated', path
+
+if __name__ == '__main__':
+    sys.exit(plac.call(migrate))
@@ -12,64 +12,491 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import itertools
 import math
+import os
+import time
+from cStringIO import StringIO
 
 from PIL import Image
 from PIL import ImageChops
 
 from huxley.errors import TestError
+from huxley.pngstream import StripWriter, open_strips
 
-def rmsdiff_2011(im1, im2):
-    "Calculate the root-mean-square difference between two images"
-    diff = ImageChops.difference(im1, im2)
-    h = diff.histogram()
-    sq = (value * (idx ** 2) for idx, value in enumerate(h))
-    sum_of_squares = sum(sq)
-    rms = math.sqrt(sum_of_squares / float(im1.size[0] * im1.size[1]))
-    return rms
+# PNGs with more pixels than STRIP_THRESHOLD (e.g. 1024x8192) are compared
+# a strip of about STRIP_PIXELS pixels at a time, so that comparing them
+# takes the same memory however tall they are. Strips are decoded and
+# differenced in Python, which is slower than doing the whole image in PIL,
+# so ordinary screenshots are still decoded whole.
+STRIP_THRESHOLD = 1 << 23
+STRIP_PIXELS = 1 << 18
 
+def _rms(histogram, pixels):
+    # Multi-band histograms are the per-band histograms laid end to end, so
+    # the difference value is the index within its band.
+    sq = (value * ((idx % 256) ** 2) for idx, value in enumerate(histogram))
+    sum_of_squares = sum(sq)
+    return math.sqrt(sum_of_squares / float(pixels))
 
-def images_identical(path1, path2):
-    im1 = Image.open(path1)
-    im2 = Image.open(path2)
-    return ImageChops.difference(im1, im2).getbbox() is None
 
+def rmsdiff_2011(im1, im2):
+    "Calculate the root-mean-square difference between two images"
+    diff = ImageChops.difference(im1, im2)
+    return _rms(diff.histogram(), im1.size[0] * im1.size[1])
 
-def image_diff(path1, path2, outpath, diffcolor):
-    im1 = Image.open(path1)
-    im2 = Image.open(path2)
 
-    rmsdiff = rmsdiff_2011(im1, im2)
+def _nearest_palette_index(im, color):
+    "Find the palette entry of a 'P' image closest to an RGB color"
+    palette = im.getpalette()
+    best, best_distance = 0, None
+    for index in xrange(len(palette) // 3):
+        entry = palette[index * 3:index * 3 + 3]
+        distance = sum((a - b) ** 2 for a, b in zip(entry, color))
+        if best_distance is None or distance < best_distance:
+            best, best_distance = index, distance
+    return best
 
-    pix1 = im1.load()
-    pix2 = im2.load()
 
-    if im1.mode != im2.mode:
-        raise TestError('Different pixel modes between %r and %r' % (path1, path2))
-    if im1.size != im2.size:
-        raise TestError('Different dimensions between %r (%r) and %r (%r)' % (path1, im1.size, path2, im2.size))
+def _changed_mask(diff, threshold=0):
+    "Build an 'L' mask that is 255 wherever any band of a difference image exceeds threshold"
+    bands = diff.split()
+    mask = bands[0]
+    for band in bands[1:]:
+        mask = ImageChops.lighter(mask, band)
+    return mask.point(lambda v: 255 if v > threshold else 0)
 
-    mode = im1.mode
 
+def _diff_value(im, diffcolor):
+    mode = im.mode
     if mode == '1':
-        value = 255
+        return 255
     elif mode == 'L':
-        value = 255
+        return 255
     elif mode == 'RGB':
-        value = diffcolor
+        return diffcolor
     elif mode == 'RGBA':
-        value = diffcolor + (255,)
+        return diffcolor + (255,)
     elif mode == 'P':
-        raise NotImplementedError('TODO: look up nearest palette color')
+        return _nearest_palette_index(im, diffcolor)
     else:
         raise NotImplementedError('Unexpected PNG mode')
 
+
+class Tolerance(object):
+    """
+    How different two screenshots may be and still pass. Channel deltas up
+    to pixel_threshold are ignored outright; beyond that, a screenshot passes
+    if it stays within every limit that is set (max_changed_pixels changed
+    pixels, an rms of max_rms). With no limits set, any changed pixel fails.
+    """
+    def __init__(self, pixel_threshold=0, max_changed_pixels=None, max_rms=None):
+        self.pixel_threshold = pixel_threshold
+        self.max_changed_pixels = max_changed_pixels
+        self.max_rms = max_rms
+
+    def accepts(self, comparison):
+        if self.max_changed_pixels is None and self.max_rms is None:
+            return comparison.changed_pixels == 0
+        if self.max_changed_pixels is not None and comparison.changed_pixels > self.max_changed_pixels:
+            return False
+        if self.max_rms is not None and comparison.rms > self.max_rms:
+            return False
+        return True
+
+    def __repr__(self):
+        return 'Tolerance(pixel_threshold=%r, max_changed_pixels=%r, max_rms=%r)' % (
+            self.pixel_threshold, self.max_changed_pixels, self.max_rms
+        )
+
+EXACT = Tolerance()
+
+
+class Regions(object):
+    """
+    Which parts of a screenshot to compare, as lists of (left, top, right,
+    bottom) boxes. Only pixels inside an include box are compared (the whole
+    screenshot if there are none), minus anything inside an ignore box.
+    """
+    def __init__(self, include=None, ignore=None):
+        self.include = [tuple(box) for box in include or ()]
+        self.ignore = [tuple(box) for box in ignore or ()]
+
+    def merged(self, other):
+        return Regions(self.include + other.include, self.ignore + other.ignore)
+
+    def moved(self, dy):
+        "The same regions, dy pixels lower down"
+        move = lambda box: (box[0], box[1] + dy, box[2], box[3] + dy)
+        return Regions(map(move, self.include), map(move, self.ignore))
+
+    def __nonzero__(self):
+        return bool(self.include or self.ignore)
+
+    def __repr__(self):
+        return 'Regions(include=%r, ignore=%r)' % (self.include, self.ignore)
+
+EVERYWHERE = Regions()
+
+
+class ImageComparison(object):
+    """
+    The result of comparing two images. Both images are decoded once and
+    their difference is computed once; everything else is derived from it.
+    """
+    def __init__(self, width, height, bbox=None, rms=0.0, changed_pixels=0):
+        self.width = width
+        self.height = height
+        self.bbox = bbox
+        self.rms = rms
+        self.changed_pixels = changed_pixels
+        self.passed = self.identical
+        # Seconds spent on each part of the comparison (see huxley.timing)
+        self.timings = {}
+
+    @property
+    def identical(self):
+        return self.bbox is None
+
+    def __repr__(self):
+        return 'ImageComparison(rms=%r, changed_pixels=%r, bbox=%r, size=%r)' % (
+            self.rms, self.changed_pixels, self.bbox, (self.width, self.height)
+        )
+
+
+def load_image(source):
+    "Open and decode an image from a path or file object"
+    if isinstance(source, Image.Image):
+        return source
+    im = Image.open(source)
+    im.load()
+    return im
+
+
+def fingerprint(im):
+    "Hash the decoded pixels of an image, so encoder differences don't matter"
+    h = hashlib.sha1()
+    h.update('%s %dx%d\n' % (im.mode, im.size[0], im.size[1]))
+    if im.mode == 'P':
+        h.update(str(bytearray(im.getpalette())))
+    h.update(im.tobytes())
+    return h.hexdigest()
+
+
+def _strip_rows(reader):
+    return max(1, STRIP_PIXELS // reader.size[0])
+
+
+def _fingerprint_strips(reader):
+    "fingerprint, a strip at a time"
+    h = hashlib.sha1()
+    h.update('%s %dx%d\n' % (reader.mode, reader.size[0], reader.size[1]))
+    for top, strip in reader.strips(_strip_rows(reader)):
+        if top == 0 and reader.mode == 'P':
+            h.update(str(bytearray(strip.getpalette())))
+        h.update(strip.tobytes())
+    return h.hexdigest()
+
+
+def _name(source):
+    if isinstance(source, basestring):
+        return source
+    if isinstance(source, Image.Image):
+        return getattr(source, 'filename', None) or '<in-memory image>'
+    return getattr(source, 'name', '<in-memory image>')
+
+
+def _clip(box, size):
+    left, top, right, bottom = box
+    return (
+        max(0, min(left, size[0])),
+        max(0, min(top, size[1])),
+        max(0, min(right, size[0])),
+        max(0, min(bottom, size[1]))
+    )
+
+
+def _difference(im1, im2):
+    if im1.mode == 'P':
+        # Palette indices are only meaningful relative to their own palette,
+        # so compare the actual colors.
+        return ImageChops.difference(im1.convert('RGBA'), im2.convert('RGBA'))
+    return ImageChops.difference(im1, im2)
+
+
+def _masked_difference(im1, im2, regions):
+    "Return the difference image and the number of pixels that were compared"
+    size = im1.size
+    if not regions.include:
+        diff = _difference(im1, im2)
+        pixels = size[0] * size[1]
+    else:
+        # Only diff (and for palette images, convert) the cropped regions.
+        diff = None
+        pixels = 0
+        for box in regions.include:
+            box = _clip(box, size)
+            if box[2] <= box[0] or box[3] <= box[1]:
+                continue
+            region = _difference(im1.crop(box), im2.crop(box))
+            if diff is None:
+                diff = Image.new(region.mode, size, 0)
+            diff.paste(region, box)
+            pixels += (box[2] - box[0]) * (box[3] - box[1])
+        if diff is None:
+            diff = Image.new('RGBA' if im1.mode == 'P' else im1.mode, size, 0)
+    for box in regions.ignore:
+        box = _clip(box, size)
+        if box[2] > box[0] and box[3] > box[1]:
+            diff.paste(0, box)
+    return diff, pixels
+
+
+def _open_strips(path1, path2):
+    "StripReaders for two PNGs too big to decode whole, or None"
+    if isinstance(path1, Image.Image) or isinstance(path2, Image.Image):
+        return None
+    readers = []
+    for path in (path1, path2):
+        reader = open_strips(path)
+        if reader is None:
+            break
+        readers.append(reader)
+        if reader.size[0] * reader.size[1] <= STRIP_THRESHOLD:
+            break
+    else:
+        return readers
+    for reader in readers:
+        reader.close()
+    return None
+
+
+def compare_images(path1, path2, diffpath=None, diffcolor=None, tolerance=EXACT, regions=EVERYWHERE):
+    """
+    Compare two images, given as paths, file objects or already decoded
+    images, and decide whether the second passes within tolerance. Only the
+    given regions are compared. If it fails and diffpath is given, the second
+    image is written there with every changed pixel painted in diffcolor.
+    """
+    readers = _open_strips(path1, path2)
+    if readers is not None:
+        try:
+            return _compare_strips(readers, path1, path2, diffpath, diffcolor, tolerance, regions)
+        finally:
+            for reader in readers:
+                reader.close()
+
+    start = time.time()
+    im1 = load_image(path1)
+    im2 = load_image(path2)
+    timings = {'decode': time.time() - start}
+
+    if im1.mode != im2.mode:
+        raise TestError('Different pixel modes between %r and %r' % (_name(path1), _name(path2)))
+    if im1.size != im2.size:
+        raise TestError('Different dimensions between %r (%r) and %r (%r)' % (
+            _name(path1), im1.size, _name(path2), im2.size
+        ))
+
+    start = time.time()
     width, height = im1.size
+    diff, pixels = _masked_difference(im1, im2, regions)
+
+    bbox = diff.getbbox()
+    if bbox is None:
+        comparison = ImageComparison(width, height)
+        timings['compare'] = time.time() - start
+        comparison.timings = timings
+        return comparison
+
+    mask = _changed_mask(diff, tolerance.pixel_threshold)
+    comparison = ImageComparison(
+        width,
+        height,
+        bbox=bbox,
+        rms=_rms(diff.histogram(), max(pixels, 1)),
+        changed_pixels=mask.histogram()[255]
+    )
+    comparison.passed = tolerance.accepts(comparison)
+    timings['compare'] = time.time() - start
+
+    if diffpath and not comparison.passed:
+        start = time.time()
+        fill = Image.new(im2.mode, im2.size, _diff_value(im2, diffcolor))
+        Image.composite(fill, im2, mask).save(diffpath)
+        timings['diff write'] = time.time() - start
+
+    comparison.timings = timings
+    return comparison
+
+
+def _compare_strips(readers, path1, path2, diffpath, diffcolor, tolerance, regions):
+    """
+    compare_images for two PNGs a strip at a time. The diff is written as it
+    goes, and kept only if the images turn out not to pass.
+    """
+    reader1, reader2 = readers
+    if reader1.mode != reader2.mode:
+        raise TestError('Different pixel modes between %r and %r' % (_name(path1), _name(path2)))
+    if reader1.size != reader2.size:
+        raise TestError('Different dimensions between %r (%r) and %r (%r)' % (
+            _name(path1), reader1.size, _name(path2), reader2.size
+        ))
 
-    for y in xrange(height):
-        for x in xrange(width):
-            if pix1[x, y] != pix2[x, y]:
-                pix2[x, y] = value
-    im2.save(outpath)
+    timings = {'decode': 0.0, 'compare': 0.0}
+    width, height = reader1.size
+    rows = _strip_rows(reader1)
+    strips = itertools.izip(reader1.strips(rows), reader2.strips(rows))
+    bbox = None
+    histogram = None
+    pixels = 0
+    changed_pixels = 0
+    diff_file = writer = None
+    if diffpath:
+        diff_file = open(diffpath + '.tmp', 'wb')
+        writer = StripWriter(diff_file, reader2)
+        timings['diff write'] = 0.0
+    try:
+        for top in xrange(0, height, rows):
+            start = time.time()
+            (_, strip1), (_, strip2) = next(strips)
+            timings['decode'] += time.time() - start
 
-    return (rmsdiff, width, height)
+            start = time.time()
+            diff, compared = _masked_difference(strip1, strip2, regions.moved(-top))
+            pixels += compared
+            strip_bbox = diff.getbbox()
+            mask = None
+            if strip_bbox is not None:
+                left, upper, right, lower = strip_bbox
+                strip_bbox = (left, upper + top, right, lower + top)
+                if bbox is None:
+                    bbox = strip_bbox
+                else:
+                    bbox = (
+                        min(bbox[0], strip_bbox[0]), bbox[1], max(bbox[2], strip_bbox[2]), strip_bbox[3]
+                    )
+                strip_histogram = diff.histogram()
+                if histogram is None:
+                    histogram = strip_histogram
+                else:
+                    histogram = [a + b for a, b in zip(histogram, strip_histogram)]
+                mask = _changed_mask(diff, tolerance.pixel_threshold)
+                changed_pixels += mask.histogram()[255]
+            timings['compare'] += time.time() - start
+
+            if writer is not None:
+                start = time.time()
+                if mask is not None:
+                    fill = Image.new(strip2.mode, strip2.size, _diff_value(strip2, diffcolor))
+                    strip2 = Image.composite(fill, strip2, mask)
+                writer.write(strip2)
+                timings['diff write'] += time.time() - start
+    except:
+        if diff_file is not None:
+            diff_file.close()
+            os.remove(diffpath + '.tmp')
+        raise
+
+    if bbox is None:
+        comparison = ImageComparison(width, height)
+    else:
+        comparison = ImageComparison(
+            width,
+            height,
+            bbox=bbox,
+            rms=_rms(histogram, max(pixels, 1)),
+            changed_pixels=changed_pixels
+        )
+        comparison.passed = tolerance.accepts(comparison)
+    if diff_file is not None:
+        start = time.time()
+        writer.close()
+        diff_file.close()
+        if comparison.passed:
+            os.remove(diffpath + '.tmp')
+            del timings['diff write']
+        else:
+            os.rename(diffpath + '.tmp', diffpath)
+            timings['diff write'] += time.time() - start
+    comparison.timings = timings
+    return comparison
+
+
+def png_fingerprint(png):
+    return fingerprint(load_image(StringIO(png)))
+
+
+# The zlib level new baselines are written at. Decoding a PNG takes about
+# as long at any level: 0 and 1 skip PNG's row filters and decode fastest,
+# and 9 is half their size and decodes 15-20% slower. The level 6 browsers
+# use is larger than 9 and slower to decode. benchmarks/baselines.py
+# measures the trade-off on your own screenshots.
+BASELINE_COMPRESS_LEVEL = 9
+
+
+def encode_baseline(im, compress_level=None):
+    "Encode an image as a baseline PNG"
+    if compress_level is None:
+        compress_level = BASELINE_COMPRESS_LEVEL
+    f = StringIO()
+    im.save(f, 'PNG', compress_level=compress_level)
+    return f.getvalue()
+
+
+def save_baseline(path, png, compress_level=None):
+    """
+    Write PNG data from the browser to path as a baseline, re-encoded at
+    compress_level, and return its fingerprint. This only takes picklable
+    arguments so it can run in a worker process.
+    """
+    im = load_image(StringIO(png))
+    with open(path, 'wb') as f:
+        f.write(encode_baseline(im, compress_level))
+    return fingerprint(im)
+
+
+def check_screenshot(original, png, expected_fingerprint=None, diffpath=None, diffcolor=None,
+                     tolerance=EXACT, regions=EVERYWHERE):
+    """
+    Check PNG data captured during playback against the baseline at
+    original. This only takes picklable arguments so it can run in a worker
+    process.
+    """
+    start = time.time()
+    reader = open_strips(StringIO(png))
+    if reader is not None and reader.size[0] * reader.size[1] > STRIP_THRESHOLD:
+        # Too big to decode whole; hash it a strip at a time, and compare
+        # it that way if it has changed.
+        matched = expected_fingerprint is not None and _fingerprint_strips(reader) == expected_fingerprint
+        decode = time.time() - start
+        if matched:
+            comparison = ImageComparison(reader.size[0], reader.size[1])
+            comparison.timings = {'decode': decode}
+            return comparison
+        comparison = compare_images(original, StringIO(png), diffpath, diffcolor, tolerance, regions)
+        comparison.timings['decode'] += decode
+        return comparison
+    image = load_image(StringIO(png))
+    decode = time.time() - start
+    if expected_fingerprint is not None and fingerprint(image) == expected_fingerprint:
+        # Unchanged; no need to decode the baseline at all.
+        comparison = ImageComparison(image.size[0], image.size[1])
+        comparison.timings = {'decode': decode, 'compare': time.time() - start - decode}
+        return comparison
+    comparison = compare_images(original, image, diffpath, diffcolor, tolerance, regions)
+    comparison.timings['decode'] += decode
+    return comparison
+
+
+def images_identical(path1, path2):
+    try:
+        return compare_images(path1, path2).identical
+    except TestError:
+        return False
+
+
+def image_diff(path1, path2, outpath, diffcolor):
+    comparison = compare_images(path1, path2, outpath, diffcolor)
+    return (comparison.rms, comparison.width, comparison.height)
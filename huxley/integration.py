@@ -63,8 +63,8 @@ def unittest_main(module='__main__'):
         # When running in a continuous test runner you may want the
         # tests to continue to fail (rather than re-recording new screen
         # shots) to indicate a commit that changed a screen shot but did
-        # not rerecord. TODO: we may want to build in auto-retry functionality
-        # and automatically back off the sleep factor.
+        # not rerecord. Tests with a tuned sleep factor (huxley -T) back
+        # off towards their configured one before failing.
         HuxleyTestCase.playback_only = True
         del sys.argv[1]
     # The default behavior is to play back the test and save new screen shots
@@ -13,22 +13,31 @@
 # limitations under the License.
 
 import contextlib
+import functools
 import os
 import json
 import sys
 
-import jsonpickle
 import plac
 from selenium import webdriver
 
+from huxley import fileformat
+from huxley import matrix
+from huxley.remote import Remote
+from huxley.fakedriver import FakeDriver
+from huxley import sessions
+from huxley import sleepfactor as sleepfactors
+from huxley.store import Store
 from huxley.run import TestRun
-from huxley.errors import TestError
+from huxley.errors import ScreenshotsDifferentError, TestError
+from huxley.images import Regions, Tolerance
 
 DRIVERS = {
     'firefox': webdriver.Firefox,
     'chrome': webdriver.Chrome,
     'ie': webdriver.Ie,
-    'opera': webdriver.Opera
+    'opera': webdriver.Opera,
+    'fake': FakeDriver
 }
 
 CAPABILITIES = {
@@ -39,6 +48,12 @@ CAPABILITIES = {
 }
 
 
+def parse_boxes(boxes):
+    if not boxes:
+        return []
+    return [tuple(int(x) for x in box.split(',')) for box in boxes.split()]
+
+
 @plac.annotations(
     url=plac.Annotation('URL to hit'),
     filename=plac.Annotation('Test file location'),
@@ -47,14 +62,42 @@ CAPABILITIES = {
     rerecord=plac.Annotation('Re-run the test but take new screenshots', 'flag', 'R'),
     sleepfactor=plac.Annotation('Sleep interval multiplier', 'option', 'f', float, metavar='FLOAT'),
     browser=plac.Annotation(
-        'Browser to use, either firefox, chrome, phantomjs, ie or opera.', 'option', 'b', str, metavar='NAME'
+        'Browser to use, either firefox, chrome, phantomjs, ie, opera or fake.', 'option', 'b', str, metavar='NAME'
     ),
     remote=plac.Annotation('Remote WebDriver to use', 'option', 'w', metavar='URL'),
     local=plac.Annotation('Local WebDriver URL to use', 'option', 'l', metavar='URL'),
     diffcolor=plac.Annotation('Diff color for errors (i.e. 0,255,0)', 'option', 'd', str, metavar='RGB'),
     screensize=plac.Annotation('Width and height for screen (i.e. 1024x768)', 'option', 's', metavar='SIZE'),
     autorerecord=plac.Annotation('Playback test and automatically rerecord if it fails', 'flag', 'a'),
-    save_diff=plac.Annotation('Save information about failures as last.png and diff.png', 'flag', 'e')
+    save_diff=plac.Annotation(
+        'Save information about failures as last.png and diff.png, or as lastN.png and diffN.png for screenshot N when every screenshot is compared (i.e. --keep-going or autorerecord)', 'flag', 'e'
+    ),
+    tune_sleepfactor=plac.Annotation(
+        'Find and save the smallest sleep factor, up to --sleepfactor, that the test passes with', 'flag', 'T'
+    ),
+    fast=plac.Annotation('Run each step as soon as the page settles rather than after the recorded delay', 'flag', 'F'),
+    keep_going=plac.Annotation('Compare every screenshot instead of stopping at the first difference', 'flag', 'K'),
+    pixelthreshold=plac.Annotation(
+        'Ignore per-channel pixel differences up to this value', 'option', 't', int, metavar='NUMBER'
+    ),
+    maxchangedpixels=plac.Annotation(
+        'Pass screenshots with at most this many changed pixels', 'option', 'm', int, metavar='NUMBER'
+    ),
+    maxrms=plac.Annotation('Pass screenshots with at most this RMS difference', 'option', 'M', float, metavar='FLOAT'),
+    include=plac.Annotation(
+        'Only compare these regions (i.e. "0,0,1024,90 0,600,1024,768")', 'option', 'I', str, metavar='BOXES'
+    ),
+    ignore=plac.Annotation(
+        'Don\'t compare these regions (i.e. "900,0,1024,20")', 'option', 'i', str, metavar='BOXES'
+    ),
+    baselines=plac.Annotation(
+        'Play back the recording in FILENAME at --screensize, keeping screenshots in DIR instead', 'option', 'B', str,
+        metavar='DIR'
+    ),
+    store=plac.Annotation(
+        'Keep baseline screenshots in the content-addressed store in DIR (see huxley-store)', 'option', 'S', str,
+        metavar='DIR'
+    )
 )
 def main(
         testname,
@@ -70,7 +113,17 @@ def main(
         diffcolor='0,255,0',
         screensize='1024x768',
         autorerecord=False,
-        save_diff=False):
+        save_diff=False,
+        tune_sleepfactor=False,
+        fast=False,
+        keep_going=False,
+        pixelthreshold=0,
+        maxchangedpixels=None,
+        maxrms=None,
+        include=None,
+        ignore=None,
+        baselines=None,
+        store=None):
 
     if postdata:
         if postdata == '-':
@@ -79,62 +132,117 @@ def main(
             with open(postdata, 'r') as f:
                 postdata = json.loads(f.read())
     try:
-        if remote:
-            d = webdriver.Remote(remote, CAPABILITIES[browser])
+        if remote and browser in CAPABILITIES:
+            new_driver = functools.partial(Remote, remote, CAPABILITIES[browser])
         else:
-            d = DRIVERS[browser]()
+            new_driver = DRIVERS[browser]
         screensize = tuple(int(x) for x in screensize.split('x'))
     except KeyError:
         raise ValueError(
             '[%s] Invalid browser %r; valid browsers are %r.' % (testname, browser, DRIVERS.keys())
         )
 
+    if record and baselines:
+        raise ValueError('[%s] Only the first browser and screen size can be recorded.' % testname)
+    # Where screenshots go; the recording is always in filename.
+    path = baselines or filename
     try:
-        os.makedirs(filename)
+        os.makedirs(path)
     except:
         pass
 
     diffcolor = tuple(int(x) for x in diffcolor.split(','))
-    jsonfile = os.path.join(filename, 'record.json')
+    tolerance = Tolerance(pixelthreshold, maxchangedpixels, maxrms)
+    regions = Regions(parse_boxes(include), parse_boxes(ignore))
+    if store:
+        store = Store(store)
+    jsonfile = os.path.join(path, 'record.json')
+    if baselines:
+        new_variant = not os.path.exists(jsonfile)
+        load_test = lambda: matrix.load(filename, baselines, screensize)
+    else:
+        new_variant = False
+        load_test = lambda: fileformat.load(jsonfile)
+    if new_variant and not (rerecord or autorerecord):
+        raise TestError('[%s] There are no screenshots in %s to compare with yet.' % (testname, path))
 
-    with contextlib.closing(d):
+    with sessions.POOL.driver((browser, remote), new_driver) as d:
         if record:
-            if local:
-                local_d = webdriver.Remote(local, CAPABILITIES[browser])
+            if local and browser in CAPABILITIES:
+                local_d = Remote(local, CAPABILITIES[browser])
             else:
                 local_d = d
-            with contextlib.closing(local_d):
-                with open(jsonfile, 'w') as f:
-                    f.write(
-                        jsonpickle.encode(
-                            TestRun.record(local_d, d, (url, postdata), screensize, filename, diffcolor, sleepfactor, save_diff)
-                        )
-                    )
+            # Only close a browser we opened ourselves; d goes back to the pool.
+            with contextlib.closing(local_d) if local_d is not d else contextlib.nested():
+                fileformat.dump(
+                    TestRun.record(local_d, d, (url, postdata), screensize, filename, diffcolor, sleepfactor, save_diff, tolerance, regions, fast, store),
+                    jsonfile
+                )
             print 'Test recorded successfully'
             return 0
         elif rerecord:
-            with open(jsonfile, 'r') as f:
-                TestRun.rerecord(jsonpickle.decode(f.read()), filename, (url, postdata), d, sleepfactor, diffcolor, save_diff)
-                print 'Test rerecorded successfully'
-                return 0
+            test = load_test()
+            TestRun.rerecord(test, path, (url, postdata), d, sleepfactor, diffcolor, save_diff, tolerance, regions, fast, store)
+            # Rerecording refreshes the screenshot fingerprints
+            fileformat.dump(test, jsonfile)
+            print 'Test rerecorded successfully'
+            return 0
+        elif autorerecord and new_variant:
+            test = load_test()
+            print 'Taking the first screenshots for', path
+            TestRun.rerecord(test, path, (url, postdata), d, sleepfactor, diffcolor, save_diff, tolerance, regions, fast, store)
+            fileformat.dump(test, jsonfile)
+            print 'Test rerecorded successfully'
+            return 2
+        elif tune_sleepfactor:
+            test = load_test()
+            tuned = sleepfactors.tune(
+                lambda factor: TestRun.playback(
+                    test, path, (url, postdata), d, factor, diffcolor, save_diff, tolerance, regions, fast, store=store
+                ),
+                sleepfactor
+            )
+            sleepfactors.save(path, tuned)
+            print 'Test passes with sleep factor', tuned
+            return 0
         elif autorerecord:
-            with open(jsonfile, 'r') as f:
-                test = jsonpickle.decode(f.read())
+            test = load_test()
             try:
                 print 'Running test to determine if we need to rerecord'
-                TestRun.playback(test, filename, (url, postdata), d, sleepfactor, diffcolor, save_diff)
+                # Keep going so a failing playback leaves every screenshot
+                # behind to rerecord from.
+                sleepfactors.playback_with_backoff(
+                    lambda factor: TestRun.playback(
+                        test, path, (url, postdata), d, factor, diffcolor, save_diff, tolerance, regions, fast, True, store
+                    ),
+                    path,
+                    sleepfactor
+                )
                 print 'Test played back successfully'
                 return 0
+            except ScreenshotsDifferentError as e:
+                print 'Test failed, rerecording...'
+                TestRun.rerecord_from_failure(e.run, sleepfactor)
+                fileformat.dump(test, jsonfile)
+                print 'Test rerecorded successfully'
+                return 2
             except TestError:
                 print 'Test failed, rerecording...'
-                TestRun.rerecord(test, filename, (url, postdata), d, sleepfactor, diffcolor, save_diff)
+                TestRun.rerecord(test, path, (url, postdata), d, sleepfactor, diffcolor, save_diff, tolerance, regions, fast, store)
+                fileformat.dump(test, jsonfile)
                 print 'Test rerecorded successfully'
                 return 2
         else:
-            with open(jsonfile, 'r') as f:
-                TestRun.playback(jsonpickle.decode(f.read()), filename, (url, postdata), d, sleepfactor, diffcolor, save_diff)
-                print 'Test played back successfully'
-                return 0
+            test = load_test()
+            sleepfactors.playback_with_backoff(
+                lambda factor: TestRun.playback(
+                    test, path, (url, postdata), d, factor, diffcolor, save_diff, tolerance, regions, fast, keep_going, store
+                ),
+                path,
+                sleepfactor
+            )
+            print 'Test played back successfully'
+            return 0
 
 if __name__ == '__main__':
     sys.exit(plac.call(main))
@@ -0,0 +1,76 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Playing one recording back in several browsers and screen sizes. A test
+# with
+#
+#   browsers=firefox chrome
+#   screensize=1024x768 768x1024 375x667
+#
+# in its Huxleyfile section is recorded once, in the first browser at the
+# first size, and played back in every combination. The first combination
+# keeps its screenshots in the test's .huxley directory as usual; each of
+# the others keeps its own in a subdirectory named after it (i.e.
+# toggle.huxley/chrome-375x667), along with a copy of record.json holding
+# its screenshot fingerprints.
+
+import collections
+import os
+
+from huxley import fileformat
+from huxley.steps import ScreenshotTestStep
+
+Variant = collections.namedtuple('Variant', ['browser', 'screensize', 'name'])
+
+
+def variants(browsers, screensizes):
+    """
+    Every combination of the space-separated browsers and screen sizes, the
+    first of them being the recorded one, whose name is None.
+    """
+    result = []
+    for browser in browsers.split():
+        for screensize in screensizes.split():
+            name = '%s-%s' % (browser, screensize) if result else None
+            result.append(Variant(browser, screensize, name))
+    return result
+
+
+def get_path(filename, variant):
+    "Where a variant keeps its screenshots"
+    if variant.name is None:
+        return filename
+    return os.path.join(filename, variant.name)
+
+
+def load(filename, path, screen_size):
+    """
+    Load the test recorded in filename to play back at screen_size, with
+    the screenshot fingerprints last saved to path, if any.
+    """
+    test = fileformat.load(os.path.join(filename, 'record.json'))
+    test.screen_size = screen_size
+    try:
+        previous = fileformat.load(os.path.join(path, 'record.json'))
+    except IOError:
+        previous = None
+    fingerprints = {}
+    if previous is not None:
+        fingerprints = dict(
+            (step.index, step.fingerprint) for step in previous.steps if isinstance(step, ScreenshotTestStep)
+        )
+    for step in test.steps:
+        if isinstance(step, ScreenshotTestStep):
+            step.fingerprint = fingerprints.get(step.index)
+    return test
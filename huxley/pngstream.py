@@ -0,0 +1,183 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Reading and writing PNGs a strip of rows at a time, so that comparing
+# full-page screenshots (1024x20000 and up) needs memory for a few strips
+# rather than for several copies of the whole page (see
+# huxley.images.compare_images).
+#
+# Only 8-bit, non-interlaced PNGs in a mode PIL lays out the way PNG does
+# (L, LA, RGB, RGBA and P) can be read this way, which covers what browsers
+# produce. PIL still does the decoding: each strip's rows are handed to its
+# PNG decoder after the last row of the strip before, so that rows filtered
+# against the row above them come out right.
+
+import struct
+import zlib
+
+from PIL import Image
+
+SIGNATURE = '\x89PNG\r\n\x1a\n'
+# PNG color types
+COLOR_TYPES = {'L': 0, 'RGB': 2, 'P': 3, 'LA': 4, 'RGBA': 6}
+# Inflate at most this many bytes at a time
+CHUNK_SIZE = 1 << 16
+
+
+def _chunks(f):
+    "(type, data) for each chunk of a PNG file, after its signature"
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise IOError('Truncated PNG file')
+        length, type = struct.unpack('>I4s', header)
+        data = f.read(length)
+        f.read(4)
+        yield type, data
+        if type == 'IEND':
+            return
+
+
+class StripReader(object):
+    def __init__(self, f, im, close):
+        self.f = f
+        self.mode = im.mode
+        self.size = im.size
+        self.info = im.info
+        self.palette = im.palette.getdata() if im.mode == 'P' else None
+        self._close = close
+        if f.read(8) != SIGNATURE:
+            raise IOError('Not a PNG file')
+        self.chunks = _chunks(f)
+        # Chunks to copy to a diff of this image
+        self.extra = []
+        for type, data in self.chunks:
+            if type == 'IDAT':
+                self.idat = data
+                break
+            if type in ('PLTE', 'tRNS'):
+                self.extra.append((type, data))
+
+    def _inflated(self):
+        "The filtered rows, a piece at a time"
+        d = zlib.decompressobj()
+        data = self.idat
+        while True:
+            while data:
+                yield d.decompress(data, CHUNK_SIZE)
+                data = d.unconsumed_tail
+            type, data = next(self.chunks, ('IEND', ''))
+            if type == 'IEND':
+                break
+            if type != 'IDAT':
+                data = ''
+        yield d.flush()
+
+    def _decode(self, data, rows):
+        strip = Image.frombytes(self.mode, (self.size[0], rows), zlib.compress(data, 0), 'zip', self.mode)
+        if self.palette is not None:
+            strip.putpalette(self.palette[1], self.palette[0])
+        if 'transparency' in self.info:
+            strip.info['transparency'] = self.info['transparency']
+        return strip
+
+    def strips(self, rows):
+        "(top, image) for each strip of up to rows rows"
+        width, height = self.size
+        stride = 1 + width * len(self.mode)
+        inflated = self._inflated()
+        pending = ''
+        previous = None
+        for top in xrange(0, height, rows):
+            count = min(rows, height - top)
+            pieces = [pending]
+            size = len(pending)
+            while size < count * stride:
+                piece = next(inflated, None)
+                if piece is None:
+                    raise IOError('Truncated PNG data')
+                pieces.append(piece)
+                size += len(piece)
+            data = ''.join(pieces)
+            pending = data[count * stride:]
+            data = data[:count * stride]
+            if previous is None:
+                strip = self._decode(data, count)
+            else:
+                # The last row of the previous strip, unfiltered
+                strip = self._decode('\0' + previous + data, count + 1).crop((0, 1, width, count + 1))
+            previous = strip.crop((0, count - 1, width, count)).tobytes()
+            yield top, strip
+
+    def close(self):
+        if self._close:
+            self.f.close()
+
+
+def open_strips(source):
+    """
+    Open a PNG path or file object to read in strips, or return None if it
+    can't be, leaving a file object where it was.
+    """
+    if isinstance(source, basestring):
+        f = open(source, 'rb')
+        close = True
+    else:
+        f = source
+        close = False
+    start = f.tell()
+    try:
+        im = Image.open(f)
+        readable = (
+            im.format == 'PNG' and im.mode in COLOR_TYPES and not im.info.get('interlace') and
+            len(im.tile) == 1 and im.tile[0][0] == 'zip' and im.tile[0][3] == im.mode
+        )
+    except IOError:
+        readable = False
+    f.seek(start)
+    if not readable:
+        if close:
+            f.close()
+        return None
+    return StripReader(f, im, close)
+
+
+class StripWriter(object):
+    "Writes a PNG a strip at a time, in the mode and with the palette of a StripReader's image"
+    def __init__(self, f, reader):
+        self.f = f
+        self.mode = reader.mode
+        self.compressor = zlib.compressobj()
+        f.write(SIGNATURE)
+        width, height = reader.size
+        self._chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, COLOR_TYPES[reader.mode], 0, 0, 0))
+        for type, data in reader.extra:
+            self._chunk(type, data)
+
+    def _chunk(self, type, data):
+        self.f.write(struct.pack('>I', len(data)) + type + data)
+        self.f.write(struct.pack('>I', zlib.crc32(type + data) & 0xffffffff))
+
+    def write(self, strip):
+        data = strip.tobytes()
+        row = strip.size[0] * len(self.mode)
+        # Unfiltered, i.e. filter type 0 on every row
+        rows = ''.join('\0' + data[i:i + row] for i in xrange(0, len(data), row))
+        compressed = self.compressor.compress(rows)
+        if compressed:
+            self._chunk('IDAT', compressed)
+
+    def close(self):
+        self._chunk('IDAT', self.compressor.flush())
+        self._chunk('IEND', '')
@@ -0,0 +1,158 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Selenium's RemoteConnection builds a new urllib2 opener, and opens a new
+# TCP connection, for every WebDriver command. A test sends hundreds of
+# commands, so against a grid running dozens of sessions at once the
+# connection setup (and sockets left in TIME_WAIT) adds up.
+# KeepAliveConnection speaks the same wire protocol over one persistent
+# HTTP/1.1 connection per session. It doesn't go through proxies, so
+# sessions that urllib2 would proxy keep selenium's own connection.
+
+import base64
+import httplib
+import socket
+import threading
+import urllib
+import urlparse
+
+from selenium import webdriver
+from selenium.webdriver.remote import utils
+from selenium.webdriver.remote.errorhandler import ErrorCode
+from selenium.webdriver.remote.remote_connection import RemoteConnection
+
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307)
+
+
+class KeepAliveConnection(RemoteConnection):
+    def __init__(self, remote_server_addr):
+        super(KeepAliveConnection, self).__init__(remote_server_addr)
+        self.lock = threading.Lock()
+        self.connection = None
+        self.netloc = None
+
+    def _connect(self, parsed):
+        if self.connection is not None and self.netloc == parsed.netloc:
+            return False
+        self.close()
+        if parsed.scheme == 'https':
+            self.connection = httplib.HTTPSConnection(parsed.hostname, parsed.port)
+        else:
+            self.connection = httplib.HTTPConnection(parsed.hostname, parsed.port)
+        self.netloc = parsed.netloc
+        return True
+
+    def _send(self, parsed, method, body, headers):
+        path = parsed.path + ('?' + parsed.query if parsed.query else '')
+        while True:
+            fresh = self._connect(parsed)
+            # The server may have closed the connection while it was idle;
+            # that's only worth retrying on a reused connection, and only
+            # if the server can't have seen the request, since commands
+            # like clicks mustn't run twice.
+            try:
+                self.connection.request(method, path, body, headers)
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                if fresh:
+                    raise
+                continue
+            try:
+                response = self.connection.getresponse()
+                data = response.read()
+            except httplib.BadStatusLine as e:
+                self.close()
+                if fresh or not _nothing_read(e):
+                    raise
+                continue
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                raise
+            if response.getheader('connection', '').lower() == 'close':
+                self.close()
+            return response, data
+
+    def _request(self, url, data=None, method=None):
+        body = data.encode('utf-8') if data is not None else None
+        for _ in xrange(MAX_REDIRECTS):
+            parsed = urlparse.urlparse(url)
+            headers = {
+                'Accept': 'application/json',
+                'Content-Type': 'application/json;charset=UTF-8',
+                'Connection': 'keep-alive'
+            }
+            if parsed.username:
+                headers['Authorization'] = 'Basic ' + base64.b64encode(
+                    '%s:%s' % (parsed.username, parsed.password or '')
+                )
+            with self.lock:
+                response, content = self._send(parsed, method, body, headers)
+            location = response.getheader('location')
+            if response.status in REDIRECT_CODES and location:
+                # i.e. older servers answer a new session with a 303
+                url = urlparse.urljoin(url, location)
+                method = 'GET'
+                body = None
+                continue
+            return self._parse(response, content)
+        raise httplib.HTTPException('Too many redirects from %s' % url)
+
+    def _parse(self, response, content):
+        # The same as selenium's RemoteConnection
+        if 399 < response.status < 500:
+            return {'status': response.status, 'value': content}
+        content = content.decode('utf-8').replace('\x00', '').strip()
+        if response.getheader('content-type', '').startswith('image/png'):
+            return {'status': ErrorCode.SUCCESS, 'value': content}
+        try:
+            data = utils.load_json(content)
+        except ValueError:
+            if 199 < response.status < 300:
+                status = ErrorCode.SUCCESS
+            else:
+                status = ErrorCode.UNKNOWN_ERROR
+            return {'status': status, 'value': content}
+        if 'value' not in data:
+            data['value'] = None
+        return data
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def _nothing_read(e):
+    "Whether a BadStatusLine means the connection closed before any reply"
+    # Older Pythons raise it with the empty line, newer with a message
+    return e.line in ('', "''") or e.line.startswith('No status line received')
+
+
+def _proxied(url):
+    "Whether urllib2 would send requests to url through a proxy"
+    parsed = urlparse.urlparse(url)
+    if parsed.scheme not in urllib.getproxies():
+        return False
+    return not urllib.proxy_bypass(parsed.hostname)
+
+
+def Remote(url, desired_capabilities):
+    """
+    Start a remote WebDriver session with its own keep-alive connection,
+    or selenium's usual one if it goes through a proxy
+    """
+    if _proxied(url):
+        return webdriver.Remote(RemoteConnection(url), desired_capabilities)
+    return webdriver.Remote(KeepAliveConnection(url), desired_capabilities)
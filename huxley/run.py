@@ -17,9 +17,13 @@ import operator
 import os
 import time
 
+from huxley import images
+from huxley import steps
+from huxley import timing
 from huxley.consts import TestRunModes
-from huxley.errors import TestError
-from huxley.steps import ScreenshotTestStep, ClickTestStep, KeyTestStep
+from huxley.errors import ScreenshotsDifferentError, TestError
+from huxley.images import EVERYWHERE, EXACT, save_baseline
+from huxley.steps import ScreenshotTestStep, ClickTestStep, KeyTestStep, execute_batch
 
 def get_post_js(url, postdata):
     markup = '<form method="post" action="%s">' % url
@@ -40,6 +44,75 @@ def get_post_js(url, postdata):
     return '(function(){ ' + js + '; })();'
 
 
+# Tracks what the page is still busy with so fast playback can run each
+# step as soon as the page settles instead of sleeping for the recorded time.
+QUIESCENCE_JS = '''
+(function() {
+if (window._huxleyIsQuiet) { return; }
+var pending = 0;
+var lastChange = +new Date();
+function done() { pending--; lastChange = +new Date(); }
+var send = XMLHttpRequest.prototype.send;
+XMLHttpRequest.prototype.send = function() {
+  pending++;
+  this.addEventListener('loadend', done);
+  return send.apply(this, arguments);
+};
+if (window.fetch) {
+  var fetch = window.fetch;
+  window.fetch = function() {
+    pending++;
+    return fetch.apply(this, arguments).then(
+      function(response) { done(); return response; },
+      function(error) { done(); throw error; }
+    );
+  };
+}
+if (window.MutationObserver) {
+  new MutationObserver(function() { lastChange = +new Date(); }).observe(
+    document, {attributes: true, childList: true, characterData: true, subtree: true}
+  );
+}
+window._huxleyIsQuiet = function(quietMs) {
+  if (pending > 0 || document.readyState !== 'complete') { return false; }
+  if (document.fonts && document.fonts.status !== 'loaded') { return false; }
+  if (document.getAnimations) {
+    var animations = document.getAnimations();
+    for (var i = 0; i < animations.length; i++) {
+      if (animations[i].playState === 'running') { return false; }
+    }
+  }
+  return +new Date() - lastChange >= quietMs;
+};
+})();
+'''
+
+# How long the DOM must go unchanged before the page counts as settled
+QUIET_MS = 100
+POLL_INTERVAL = 0.05
+
+
+def wait_until_quiet(d, timeout):
+    """
+    Wait until the page has no pending requests, running animations or
+    loading fonts and its DOM has stopped changing, for at most timeout
+    seconds. Returns how long it waited.
+    """
+    # A page that replaced the one the hook was installed in (e.g. the
+    # response to a POST) gets the hook again, and is waited for from then
+    # on, starting with it finishing loading.
+    poll = QUIESCENCE_JS + 'return window._huxleyIsQuiet(%d);' % QUIET_MS
+    start = time.time()
+    while True:
+        if d.execute_script(poll):
+            break
+        elapsed = time.time() - start
+        if elapsed >= timeout:
+            break
+        time.sleep(min(POLL_INTERVAL, timeout - elapsed))
+    return time.time() - start
+
+
 def navigate(d, url):
     href, postdata = url
     d.get('about:blank')
@@ -57,7 +130,14 @@ class Test(object):
 
 
 class TestRun(object):
-    def __init__(self, test, path, url, d, mode, diffcolor, save_diff):
+    """
+    One pass over a test's steps. By default playback stops at the first
+    screenshot found to be different; with keep_going it compares every
+    screenshot and raises a ScreenshotsDifferentError for all of them at
+    the end.
+    """
+    def __init__(self, test, path, url, d, mode, diffcolor, save_diff, tolerance=EXACT, regions=EVERYWHERE, fast=False,
+                 keep_going=False, store=None):
         if not isinstance(test, Test):
             raise ValueError('You must provide a Test instance')
         self.test = test
@@ -67,43 +147,165 @@ class TestRun(object):
         self.mode = mode
         self.diffcolor = diffcolor
         self.save_diff = save_diff
+        self.tolerance = tolerance
+        self.regions = regions
+        self.fast = fast
+        self.keep_going = keep_going
+        # A huxley.store.Store to keep baseline screenshots in, if any
+        self.store = store
+        self.deferred = []
+        # Screenshot steps that were different, and every (step, png)
+        # captured, in keep-going playbacks
+        self.failures = []
+        self.captures = []
 
     @classmethod
-    def rerecord(cls, test, path, url, d, sleepfactor, diffcolor, save_diff):
+    def rerecord(cls, test, path, url, d, sleepfactor, diffcolor, save_diff, tolerance=EXACT, regions=EVERYWHERE, fast=False,
+                 store=None):
         print 'Begin rerecord'
-        run = TestRun(test, path, url, d, TestRunModes.RERECORD, diffcolor, save_diff)
+        run = TestRun(test, path, url, d, TestRunModes.RERECORD, diffcolor, save_diff, tolerance, regions, fast, store=store)
         run._playback(sleepfactor)
         print
         print 'Playing back to ensure the test is correct'
         print
-        cls.playback(test, path, url, d, sleepfactor, diffcolor, save_diff)
+        cls.playback(test, path, url, d, sleepfactor, diffcolor, save_diff, tolerance, regions, fast, store=store)
+
+    @classmethod
+    def rerecord_from_failure(cls, run, sleepfactor):
+        """
+        Rerecord a failed keep-going playback from its first different
+        screenshot on. The playback already took every screenshot a
+        rerecord would, so they become the new baselines and the test is
+        only played again to make sure it is correct.
+        """
+        first = min(step.index for step in run.failures)
+        print 'Begin rerecord from screenshot', first
+        saved = []
+        for step, png in run.captures:
+            if step.index >= first:
+                print '  Rerecording screenshot', step.index
+                if run.store is not None:
+                    saved.append((step, run.store.put_async(png)))
+                else:
+                    saved.append((step, steps.COMPARISON_POOL.apply_async(
+                        save_baseline, step.get_path(run), png, images.BASELINE_COMPRESS_LEVEL
+                    )))
+        for step, result in saved:
+            step.fingerprint = result.get()
+            if run.store is not None:
+                step.remove_local(run)
+        print
+        print 'Playing back to ensure the test is correct'
+        print
+        cls.playback(run.test, run.path, run.url, run.d, sleepfactor, run.diffcolor, run.save_diff, run.tolerance,
+                     run.regions, run.fast, store=run.store)
 
     @classmethod
-    def playback(cls, test, path, url, d, sleepfactor, diffcolor, save_diff):
+    def playback(cls, test, path, url, d, sleepfactor, diffcolor, save_diff, tolerance=EXACT, regions=EVERYWHERE, fast=False,
+                 keep_going=False, store=None):
         print 'Begin playback'
-        run = TestRun(test, path, url, d, TestRunModes.PLAYBACK, diffcolor, save_diff)
+        run = TestRun(test, path, url, d, TestRunModes.PLAYBACK, diffcolor, save_diff, tolerance, regions, fast, keep_going,
+                      store)
         run._playback(sleepfactor)
 
     def _playback(self, sleepfactor):
-        self.d.set_window_size(*self.test.screen_size)
-        navigate(self.d, self.url)
+        with timing.timed('navigate', 'navigate'):
+            self.d.set_window_size(*self.test.screen_size)
+            navigate(self.d, self.url)
+            if self.fast:
+                self.d.execute_script(QUIESCENCE_JS)
         last_offset_time = 0
-        for step in self.test.steps:
+        total_sleep_time = 0
+        total_wait_time = 0
+        # Clicks and keys that follow each other without a pause are sent to
+        # the browser together.
+        batch = []
+        batch_label = None
+        for position, step in enumerate(self.test.steps):
             sleep_time = (step.offset_time - last_offset_time) * sleepfactor
-            print '  Sleeping for', sleep_time, 'ms'
-            time.sleep(float(sleep_time) / 1000)
-            step.execute(self)
             last_offset_time = step.offset_time
+            if batch and sleep_time == 0 and step.batchable:
+                batch.append(step)
+                continue
+            if batch:
+                self._execute_batch(batch_label, batch)
+                batch = []
+            label = 'step %d (%s)' % (position, step.kind)
+            total_sleep_time += sleep_time
+            if self.fast:
+                # The recorded time is only an upper bound
+                print '  Waiting up to', sleep_time, 'ms for the page to settle'
+                wait_time = wait_until_quiet(self.d, float(sleep_time) / 1000)
+                timing.record('wait', wait_time, label)
+                total_wait_time += wait_time * 1000
+            else:
+                print '  Sleeping for', sleep_time, 'ms'
+                with timing.timed('sleep', label):
+                    time.sleep(float(sleep_time) / 1000)
+            if step.batchable:
+                batch_label = label
+                batch.append(step)
+            else:
+                with timing.step(label):
+                    step.execute(self)
+                self._finish_ready()
+        if batch:
+            self._execute_batch(batch_label, batch)
+        if self.fast:
+            print '  Waited %d ms instead of sleeping for %d ms (saved %d ms)' % (
+                total_wait_time, total_sleep_time, total_sleep_time - total_wait_time
+            )
+        # Steps that deferred work (i.e. screenshot comparisons) report
+        # their results in order once the test is over.
+        deferred, self.deferred = self.deferred, []
+        for step, result, label in deferred:
+            self._finish(step, result, label)
+        if self.failures:
+            raise ScreenshotsDifferentError(
+                'Screenshots %s were different.' % ', '.join(str(step.index) for step in self.failures),
+                self
+            )
+
+    def _execute_batch(self, label, batch):
+        # Timed as a whole, against the first step in the batch
+        kind = '+'.join(sorted(set(step.kind for step in batch)))
+        with timing.step(label), timing.timed(kind):
+            execute_batch(self, batch)
+
+    def defer(self, step, result):
+        self.deferred.append((step, result, timing.current_step()))
+
+    def _finish_ready(self):
+        "Report comparisons that are already done, so a failing test stops early"
+        while self.deferred and self.deferred[0][1].ready():
+            step, result, label = self.deferred.pop(0)
+            self._finish(step, result, label)
+
+    def _finish(self, step, result, label=None):
+        with timing.step(label):
+            try:
+                with timing.timed('comparison wait'):
+                    value = result.get()
+            except TestError as e:
+                # Screenshots that can't be compared at all (i.e. the page
+                # changed size) are differences too.
+                if not self.keep_going:
+                    raise
+                print '  ' + str(e)
+                self.failures.append(step)
+                return
+            step.finish(self, value)
 
     @classmethod
-    def record(cls, d, remote_d, url, screen_size, path, diffcolor, sleepfactor, save_diff):
+    def record(cls, d, remote_d, url, screen_size, path, diffcolor, sleepfactor, save_diff, tolerance=EXACT, regions=EVERYWHERE, fast=False,
+               store=None):
         print 'Begin record'
         try:
             os.makedirs(path)
         except:
             pass
         test = Test(screen_size)
-        run = TestRun(test, path, url, d, TestRunModes.RECORD, diffcolor, save_diff)
+        run = TestRun(test, path, url, d, TestRunModes.RECORD, diffcolor, save_diff, tolerance, regions, fast)
         d.set_window_size(*screen_size)
         navigate(d, url)
         start_time = d.execute_script('return +new Date();')
@@ -149,7 +351,7 @@ window._getHuxleyEvents = function() { return events; };
             'Press enter to start.'
         )
         print
-        cls.rerecord(test, path, url, remote_d, sleepfactor, diffcolor, save_diff)
+        cls.rerecord(test, path, url, remote_d, sleepfactor, diffcolor, save_diff, tolerance, regions, fast, store)
 
         return test
 
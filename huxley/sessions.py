@@ -0,0 +1,102 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import threading
+
+from huxley.errors import TestError
+
+# Storage is per-origin, so this has to run before we navigate away.
+RESET_JS = '''
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+'''
+
+class Session(object):
+    def __init__(self, key, d):
+        self.key = key
+        self.d = d
+        self.uses = 0
+
+
+class SessionPool(object):
+    """
+    WebDriver sessions shared by the tests of a run, keyed by browser and
+    WebDriver URL. Starting a browser is often slower than the test itself,
+    so a session is reset and reused until it has served max_uses tests or
+    a test using it fails with anything other than a TestError. The default
+    of one use starts a fresh browser for every test.
+    """
+    def __init__(self, max_uses=1):
+        self.max_uses = max_uses
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def checkout(self, key, factory):
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop()
+        return Session(key, factory())
+
+    def checkin(self, session):
+        session.uses += 1
+        if session.uses >= self.max_uses:
+            self.retire(session)
+            return
+        try:
+            session.d.delete_all_cookies()
+            session.d.execute_script(RESET_JS)
+            session.d.get('about:blank')
+        except Exception:
+            self.retire(session)
+            return
+        with self.lock:
+            self.idle.setdefault(session.key, []).append(session)
+
+    def retire(self, session):
+        try:
+            session.d.quit()
+        except Exception:
+            # It's probably already gone.
+            pass
+        # Drop a huxley.remote keep-alive connection along with its session
+        close = getattr(getattr(session.d, 'command_executor', None), 'close', None)
+        if close is not None:
+            close()
+
+    @contextlib.contextmanager
+    def driver(self, key, factory):
+        "Check out a driver for the duration of a with block"
+        session = self.checkout(key, factory)
+        try:
+            yield session.d
+        except TestError:
+            self.checkin(session)
+            raise
+        except:
+            self.retire(session)
+            raise
+        else:
+            self.checkin(session)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for sessions in idle.values():
+            for session in sessions:
+                self.retire(session)
+
+# Replaced by huxley.cmdline when sessions should be reused across tests.
+POOL = SessionPool()
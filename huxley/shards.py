@@ -0,0 +1,129 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Splitting a run across machines. Each machine runs
+#
+#   huxley --shard-index I --shard-count N --report shardI.json
+#
+# and picks its share of the tests of every Huxleyfile on its own, so the
+# machines need the same checkout (and --durations file, if any) to agree.
+# Then one of them merges the reports into a single exit code with
+#
+#   huxley-merge shard*.json [-o report.xml] [-d durations.json]
+
+import collections
+import json
+import sys
+
+import plac
+
+from huxley import cache
+from huxley import timing
+from huxley.consts import ExitCodes
+
+
+def partition(items, count):
+    """
+    Split (key, cost, value) items into count lists of values with roughly
+    equal total cost: costliest first, each onto the least loaded shard,
+    or the one with the fewest items. Ties are broken by key and shard
+    index, so the split only depends on the keys and costs.
+    """
+    shards = [[] for _ in xrange(count)]
+    totals = [0.0] * count
+    for key, cost, value in sorted(items, key=lambda item: (-item[1], item[0])):
+        index = min(xrange(count), key=lambda i: (totals[i], len(shards[i]), i))
+        shards[index].append(value)
+        totals[index] += cost
+    return shards
+
+
+def exit_code(report):
+    results = set(test['result'] for test in report['tests'])
+    if 'error' in results or 'failed' in results:
+        return ExitCodes.ERROR
+    if 'new screenshots' in results:
+        return ExitCodes.NEW_SCREENSHOTS
+    return ExitCodes.OK
+
+
+def merge(reports):
+    "Merge the reports of every shard of a run into one, or raise ValueError"
+    counts = set(report.get('shard', [0, 1])[1] for report in reports)
+    indexes = sorted(report.get('shard', [0, 1])[0] for report in reports)
+    if len(counts) != 1 or indexes != range(counts.pop()):
+        raise ValueError('Expected one report from each shard, got shards %r' % indexes)
+    totals = collections.defaultdict(float)
+    for report in reports:
+        for kind, seconds in report['totals'].items():
+            totals[kind] += seconds
+    return collections.OrderedDict([
+        # Shards run side by side
+        ('seconds', max(report['seconds'] for report in reports)),
+        ('totals', dict(totals)),
+        ('tests', [test for report in reports for test in report['tests']])
+    ])
+
+
+@plac.annotations(
+    reports=plac.Annotation('Reports written by each shard with --report'),
+    output=plac.Annotation(
+        'Write the merged report to FILE, as JUnit XML if it ends in .xml and JSON otherwise',
+        'option',
+        'o',
+        str,
+        metavar='FILE'
+    ),
+    durations=plac.Annotation(
+        'Update FILE with how long each test took, for huxley --durations',
+        'option',
+        'd',
+        str,
+        metavar='FILE'
+    )
+)
+def _main(output=None, durations=None, *reports):
+    loaded = []
+    for path in reports:
+        with open(path, 'r') as f:
+            loaded.append(json.loads(f.read()))
+    try:
+        report = merge(loaded)
+    except ValueError as e:
+        print e
+        return ExitCodes.ERROR
+
+    if output:
+        timing.write(report, output)
+    if durations:
+        store = cache.Durations(durations)
+        for test in report['tests']:
+            if test['result'] in ('passed', 'new screenshots'):
+                store.set(cache.test_key(test['file'], test['name']), test['seconds'])
+        store.save()
+
+    code = exit_code(report)
+    results = collections.Counter(test['result'] for test in report['tests'])
+    print '%d tests from %d shards: %s' % (
+        len(report['tests']), len(reports), ', '.join('%d %s' % (n, result) for result, n in sorted(results.items()))
+    )
+    if code == ExitCodes.NEW_SCREENSHOTS:
+        print '** New screenshots were written; please verify that they are correct. **'
+    return code
+
+def main():
+    sys.exit(plac.call(_main))
+
+if __name__ == '__main__':
+    main()
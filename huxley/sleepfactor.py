@@ -0,0 +1,101 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Most tests don't need their recorded think-time to reproduce the same
+# screenshots. These helpers find the smallest sleep factor a test still
+# passes with, remember it next to record.json and back off towards the
+# configured sleep factor when a faster playback fails.
+
+import json
+import os
+
+from huxley.errors import TestError
+
+# Stop bisecting once the bounds are this close together
+PRECISION = 0.05
+# Playbacks that must pass at a sleep factor before we trust it
+REPEAT = 2
+BACKOFF = 2.0
+
+
+def get_path(path):
+    return os.path.join(path, 'sleepfactor.json')
+
+
+def load(path):
+    "Return the tuned sleep factor for the test at path, or None"
+    try:
+        with open(get_path(path), 'r') as f:
+            return json.loads(f.read())['sleepfactor']
+    except (IOError, ValueError, KeyError):
+        return None
+
+
+def save(path, sleepfactor):
+    with open(get_path(path), 'w') as f:
+        f.write(json.dumps({'sleepfactor': sleepfactor}))
+
+
+def passes(playback, sleepfactor, repeat=REPEAT):
+    for _ in xrange(repeat):
+        try:
+            playback(sleepfactor)
+        except TestError:
+            return False
+    return True
+
+
+def tune(playback, sleepfactor):
+    """
+    Bisect between 0 and sleepfactor for the smallest sleep factor with
+    which playback(factor) passes REPEAT times in a row. playback must
+    pass at sleepfactor itself.
+    """
+    playback(sleepfactor)
+    low, high = 0.0, float(sleepfactor)
+    if passes(playback, low):
+        return low
+    while high - low > PRECISION:
+        middle = (low + high) / 2
+        print 'Trying sleep factor', middle
+        if passes(playback, middle):
+            high = middle
+        else:
+            low = middle
+    return high
+
+
+def playback_with_backoff(playback, path, sleepfactor):
+    """
+    Play back at the tuned sleep factor, if there is one, backing off
+    towards sleepfactor on failure. Only a failure at sleepfactor itself
+    is raised.
+    """
+    tuned = load(path)
+    if tuned is None or tuned >= sleepfactor:
+        playback(sleepfactor)
+        return
+    factor = tuned
+    while True:
+        try:
+            playback(factor)
+        except TestError:
+            if factor >= sleepfactor:
+                raise
+            factor = min(max(factor * BACKOFF, PRECISION), sleepfactor)
+            print 'Playback failed, backing off to sleep factor', factor
+            continue
+        if factor != tuned:
+            save(path, factor)
+        return
@@ -14,17 +14,36 @@
 
 import os
 import threading
+import time
 
+from huxley import images
+from huxley import timing
 from huxley.consts import TestRunModes
 from huxley.errors import TestError
-from huxley.images import images_identical, image_diff
+from huxley.images import Regions, check_screenshot, save_baseline
+from huxley.threadpool import ProcessPool
 
 # Since we want consistent focus screenshots we steal focus
 # when taking screenshots. To avoid races we lock during this
 # process.
 SCREENSHOT_LOCK = threading.RLock()
 
+# Comparing screenshots is CPU-bound, so it can be handed to worker
+# processes shared by every running test (see huxley.cmdline). By default
+# it runs in the test's own thread.
+COMPARISON_POOL = ProcessPool()
+
 class TestStep(object):
+    # Tests can have thousands of steps; see huxley.fileformat for how
+    # they are stored.
+    __slots__ = ('offset_time',)
+
+    # Whether consecutive steps of this kind can be sent to the browser
+    # together when nothing needs to happen between them (see execute_batch)
+    batchable = False
+    # What time spent on this step counts as (see huxley.timing)
+    kind = None
+
     def __init__(self, offset_time):
         self.offset_time = offset_time
 
@@ -33,25 +52,31 @@ class TestStep(object):
 
 
 class ClickTestStep(TestStep):
+    __slots__ = ('pos',)
     CLICK_ID = '_huxleyClick'
+    batchable = True
+    kind = 'click'
 
     def __init__(self, offset_time, pos):
         super(ClickTestStep, self).__init__(offset_time)
         self.pos = pos
 
+    def get_js(self):
+        # Work around multiple bugs in WebDriver's implementation of click()
+        return (
+            'document.elementFromPoint(%d, %d).click();' +
+            'document.elementFromPoint(%d, %d).focus();'
+        ) % (self.pos[0], self.pos[1], self.pos[0], self.pos[1])
+
     def execute(self, run):
         print '  Clicking', self.pos
-        # Work around multiple bugs in WebDriver's implementation of click()
-        run.d.execute_script(
-            'document.elementFromPoint(%d, %d).click();' % (self.pos[0], self.pos[1])
-        )
-        run.d.execute_script(
-            'document.elementFromPoint(%d, %d).focus();' % (self.pos[0], self.pos[1])
-        )
+        run.d.execute_script(self.get_js())
 
 
 class KeyTestStep(TestStep):
-    KEY_ID = '_huxleyKey'
+    __slots__ = ('key',)
+    batchable = True
+    kind = 'key'
 
     def __init__(self, offset_time, key):
         super(KeyTestStep, self).__init__(offset_time)
@@ -59,48 +84,159 @@ class KeyTestStep(TestStep):
 
     def execute(self, run):
         print '  Typing', self.key
-        id = run.d.execute_script('return document.activeElement.id;')
-        if id is None or id == '':
-            run.d.execute_script(
-                'document.activeElement.id = %r;' % self.KEY_ID
-            )
-            id = self.KEY_ID
-        run.d.find_element_by_id(id).send_keys(self.key.lower())
+        run.d.execute_script('return document.activeElement;').send_keys(self.key.lower())
+
+
+def execute_batch(run, steps):
+    """
+    Execute consecutive click and key steps with as few WebDriver round
+    trips as possible: clicks are joined into one script, which also looks
+    up the element to type into, and keys are sent to it in one go.
+    """
+    script = ''
+    keys = ''
+    element = None
+    for step in steps:
+        if isinstance(step, ClickTestStep):
+            print '  Clicking', step.pos
+            if keys:
+                element.send_keys(keys)
+                keys = ''
+            script += step.get_js()
+            element = None
+        elif isinstance(step, KeyTestStep):
+            print '  Typing', step.key
+            if element is None:
+                element = run.d.execute_script(script + 'return document.activeElement;')
+                script = ''
+            keys += step.key.lower()
+        else:
+            raise ValueError('%r can\'t be batched' % step)
+    if keys:
+        element.send_keys(keys)
+    if script:
+        run.d.execute_script(script)
 
 
 class ScreenshotTestStep(TestStep):
+    __slots__ = ('index', 'fingerprint', 'include', 'ignore')
+    kind = 'screenshot'
+
     def __init__(self, offset_time, run, index):
         super(ScreenshotTestStep, self).__init__(offset_time)
         self.index = index
+        # Hash of the baseline's decoded pixels, written on (re)record.
+        # Tests recorded before fingerprints existed don't have one.
+        self.fingerprint = None
+        # Optional (left, top, right, bottom) boxes, edited into
+        # record.json by hand, that limit this screenshot's comparison on
+        # top of the test's.
+        self.include = None
+        self.ignore = None
+
+    def get_local_path(self, run):
+        return os.path.join(run.path, 'screenshot' + str(self.index) + '.png')
 
     def get_path(self, run):
-        return os.path.join(run.path, 'screenshot' + str(self.index) + '.png')
+        path = self.get_local_path(run)
+        # Tests that haven't been migrated to their store keep their own
+        # screenshots.
+        if run.store is None or self.fingerprint is None or os.path.exists(path):
+            return path
+        return run.store.get_path(self.fingerprint)
+
+    def remove_local(self, run):
+        "Drop the test's own copy of a screenshot that is now in its store"
+        try:
+            os.remove(self.get_local_path(run))
+        except OSError:
+            pass
+
+    def get_last_path(self, run):
+        # A keep-going playback saves every failure, not just the first.
+        return os.path.join(run.path, 'last' + (str(self.index) if run.keep_going else '') + '.png')
+
+    def get_diff_path(self, run):
+        return os.path.join(run.path, 'diff' + (str(self.index) if run.keep_going else '') + '.png')
 
     def execute(self, run):
         print '  Taking screenshot', self.index
         original = self.get_path(run)
-        new = os.path.join(run.path, 'last.png')
+        new = self.get_last_path(run)
 
+        # Only hold the lock while we have focus; comparing the screenshot
+        # doesn't need it and can be slow.
+        start = time.time()
         with SCREENSHOT_LOCK:
-            # Steal focus for a consistent screenshot
-            run.d.switch_to_window(run.d.window_handles[0])
-            if run.mode == TestRunModes.RERECORD:
-                run.d.save_screenshot(original)
+            timing.record('lock wait', time.time() - start)
+            with timing.timed('capture'):
+                # Steal focus for a consistent screenshot
+                run.d.switch_to_window(run.d.window_handles[0])
+                # Compare straight from the PNG the driver hands back
+                # instead of round-tripping it through last.png.
+                png = run.d.get_screenshot_as_png()
+
+        if run.mode == TestRunModes.RERECORD:
+            if run.store is not None:
+                run.defer(self, run.store.put_async(png))
+            else:
+                run.defer(
+                    self, COMPARISON_POOL.apply_async(save_baseline, original, png, images.BASELINE_COMPRESS_LEVEL)
+                )
+        else:
+            if run.save_diff:
+                with open(new, 'wb') as f:
+                    f.write(png)
+            diffpath = self.get_diff_path(run) if run.save_diff else None
+            regions = run.regions.merged(Regions(self.include, self.ignore))
+            result = COMPARISON_POOL.apply_async(
+                check_screenshot,
+                original,
+                png,
+                self.fingerprint,
+                diffpath,
+                run.diffcolor,
+                run.tolerance,
+                regions
+            )
+            if run.save_diff and not run.keep_going:
+                # last.png and diff.png are shared by every screenshot, so
+                # stop at the one they describe.
+                with timing.timed('comparison wait'):
+                    result = result.get()
+                self.finish(run, result)
+            else:
+                run.defer(self, result)
+            if run.keep_going:
+                # Kept so a failing test can be rerecorded without playing
+                # it again (see TestRun.rerecord_from_failure)
+                run.captures.append((self, png))
+
+    def get_error(self, run, result):
+        if run.save_diff:
+            return (
+                'Screenshot %s was different; compare %s with %s. See %s ' +
+                'for the comparison. diff=%r'
+            ) % (
+                self.index,
+                self.get_path(run),
+                self.get_last_path(run),
+                self.get_diff_path(run),
+                result
+            )
+        return 'Screenshot %s was different.' % self.index
+
+    def finish(self, run, result):
+        if run.mode == TestRunModes.RERECORD:
+            self.fingerprint = result
+            if run.store is not None:
+                self.remove_local(run)
+            return
+        for kind, seconds in result.timings.items():
+            timing.record(kind, seconds)
+        if not result.passed:
+            if run.keep_going:
+                print '  ' + self.get_error(run, result)
+                run.failures.append(self)
             else:
-                run.d.save_screenshot(new)
-                try:
-                    if not images_identical(original, new):
-                        if run.save_diff:
-                            diffpath = os.path.join(run.path, 'diff.png')
-                            diff = image_diff(original, new, diffpath, run.diffcolor)
-                            raise TestError(
-                                ('Screenshot %s was different; compare %s with %s. See %s ' +
-                                 'for the comparison. diff=%r') % (
-                                    self.index, original, new, diffpath, diff
-                                )
-                            )
-                        else:
-                            raise TestError('Screenshot %s was different.' % self.index)
-                finally:
-                    if not run.save_diff:
-                        os.unlink(new)
+                raise TestError(self.get_error(run, result))
@@ -0,0 +1,222 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A content-addressed store for baseline screenshots. Tests with
+#
+#   store=screenshots
+#
+# in their Huxleyfile section (or its [DEFAULT] section) keep baselines in
+# that directory, relative to the Huxleyfile, under the fingerprint of
+# their pixels that record.json already has, i.e.
+# screenshots/3f/3f786850e387550fdab836ed7e6dc881de23001b.png. A screenshot
+# shared by several steps or tests is only stored once.
+#
+#   huxley-store migrate [-f GLOB]
+#
+# moves the screenshotN.png files of existing tests into their store, and
+#
+#   huxley-store gc [-f GLOB]
+#
+# deletes the screenshots no test refers to any more. gc only knows about
+# the Huxleyfiles it is given, so give it every one that shares a store.
+
+import ConfigParser
+import glob
+import os
+import sys
+import threading
+from cStringIO import StringIO
+
+import plac
+
+from huxley import fileformat
+from huxley import images
+from huxley import steps
+from huxley.consts import ExitCodes
+
+
+class Store(object):
+    def __init__(self, path):
+        self.path = path
+
+    def get_path(self, fingerprint):
+        return os.path.join(self.path, fingerprint[:2], fingerprint + '.png')
+
+    def put(self, png, compress_level=None):
+        """
+        Store PNG data as a baseline (see huxley.images.encode_baseline)
+        unless its pixels are already stored; returns their fingerprint.
+        """
+        im = images.load_image(StringIO(png))
+        fingerprint = images.fingerprint(im)
+        path = self.get_path(fingerprint)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            try:
+                # Shared by every test and user, so readable by all that
+                # the umask allows
+                os.makedirs(directory, 0777)
+            except OSError:
+                pass
+            # Written aside and renamed so concurrent tests never see half
+            # a file. The name is unique to this thread so it can be opened
+            # as usual, with the usual permissions.
+            tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+            with open(tmp, 'wb') as f:
+                f.write(images.encode_baseline(im, compress_level))
+            os.rename(tmp, path)
+        return fingerprint
+
+    def put_async(self, png):
+        "Store PNG data in the comparison pool, which fingerprints it anyway"
+        return steps.COMPARISON_POOL.apply_async(store_png, self.path, png, images.BASELINE_COMPRESS_LEVEL)
+
+    def fingerprints(self):
+        "Every fingerprint in the store"
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                if name.endswith('.png') and not name.startswith('.'):
+                    yield name[:-len('.png')]
+
+
+def store_png(path, png, compress_level=None):
+    "Store.put for the comparison pool, which can only pickle plain functions"
+    return Store(path).put(png, compress_level)
+
+
+def get_store_path(file, test_config):
+    "The store a Huxleyfile section uses, or None"
+    path = test_config.get('store')
+    if not path:
+        return None
+    return os.path.join(os.path.dirname(file), path)
+
+
+def get_recordings(filename):
+    "record.json of a test and of each of its huxley.matrix variants"
+    paths = []
+    if os.path.isdir(filename):
+        for path in [filename] + sorted(os.path.join(filename, name) for name in os.listdir(filename)):
+            if os.path.isfile(os.path.join(path, 'record.json')):
+                paths.append(path)
+    return paths
+
+
+def get_tests(testfiles):
+    "(store path, test directory) for every test in the Huxleyfiles that uses a store"
+    # Imported here as huxley.cmdline imports this module
+    from huxley.cmdline import DEFAULTS, get_filename
+    tests = []
+    for file in testfiles:
+        config = ConfigParser.SafeConfigParser(
+            defaults=DEFAULTS,
+            allow_no_value=True
+        )
+        config.read([file])
+        for testname in config.sections():
+            test_config = dict(config.items(testname))
+            store_path = get_store_path(file, test_config)
+            if store_path:
+                tests.append((store_path, get_filename(file, test_config, testname)))
+    return tests
+
+
+def migrate(store, path):
+    """
+    Move the screenshots of the test recorded in path into store, adding
+    fingerprints to record.json. Returns how many were moved.
+    """
+    jsonfile = os.path.join(path, 'record.json')
+    test = fileformat.load(jsonfile)
+    moved = []
+    for step in test.steps:
+        if not isinstance(step, steps.ScreenshotTestStep):
+            continue
+        local = os.path.join(path, 'screenshot%d.png' % step.index)
+        if not os.path.exists(local):
+            continue
+        with open(local, 'rb') as f:
+            # The recorded fingerprint may predate the file; trust the pixels
+            step.fingerprint = store.put(f.read())
+        moved.append(local)
+    if moved:
+        # record.json has to point into the store before the files go
+        fileformat.dump(test, jsonfile)
+        for local in moved:
+            os.remove(local)
+    return len(moved)
+
+
+def referenced(path):
+    "The fingerprints the test recorded in path refers to"
+    test = fileformat.load(os.path.join(path, 'record.json'))
+    return set(
+        step.fingerprint for step in test.steps if isinstance(step, steps.ScreenshotTestStep) and step.fingerprint
+    )
+
+
+def gc(store, references):
+    "Delete every screenshot in store not in references; returns how many"
+    removed = 0
+    for fingerprint in list(store.fingerprints()):
+        if fingerprint not in references:
+            os.remove(store.get_path(fingerprint))
+            removed += 1
+    return removed
+
+
+@plac.annotations(
+    command=plac.Annotation('migrate or gc', choices=['migrate', 'gc']),
+    testfile=plac.Annotation(
+        'Test file(s) whose tests to migrate or keep the screenshots of',
+        'option',
+        'f',
+        str,
+        metavar='GLOB'
+    )
+)
+def _main(command, testfile='Huxleyfile'):
+    testfiles = glob.glob(testfile)
+    if len(testfiles) == 0:
+        print 'no Huxleyfile found'
+        return ExitCodes.ERROR
+    tests = get_tests(testfiles)
+    if not tests:
+        print 'No tests have a store set in their Huxleyfile section'
+        return ExitCodes.ERROR
+
+    if command == 'migrate':
+        total = 0
+        for store_path, filename in tests:
+            for path in get_recordings(filename):
+                count = migrate(Store(store_path), path)
+                if count:
+                    print 'Moved %d screenshots from %s to %s' % (count, path, store_path)
+                total += count
+        print 'Moved %d screenshots' % total
+    else:
+        references = {}
+        for store_path, filename in tests:
+            refs = references.setdefault(os.path.normpath(store_path), set())
+            for path in get_recordings(filename):
+                refs.update(referenced(path))
+        for store_path, refs in sorted(references.items()):
+            print 'Deleted %d unused screenshots from %s, kept %d' % (gc(Store(store_path), refs), store_path, len(refs))
+    return ExitCodes.OK
+
+def main():
+    sys.exit(plac.call(_main))
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,64 @@
-import Queue
+import heapq
+import itertools
+import multiprocessing
+import sys
 import threading
-import time
+import traceback
 
 class ThreadPool(object):
+    """
+    Runs queued functions on a number of threads, costliest first, so the
+    longest tests don't start last and hold up the end of the run. Equally
+    costly functions run in the order they were queued. A function that
+    raises doesn't take its thread down with it; the error is printed and
+    kept in errors.
+    """
     def __init__(self):
-        self.queue = Queue.Queue()
+        self.queue = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.running = 0
+        self.errors = []
 
     def enqueue(self, func, *args, **kwargs):
-        self.queue.put((func, args, kwargs))
+        self.enqueue_with_cost(0, func, *args, **kwargs)
+
+    def enqueue_with_cost(self, cost, func, *args, **kwargs):
+        with self.lock:
+            heapq.heappush(self.queue, (-cost, next(self.counter), func, args, kwargs))
 
     def work(self, concurrency):
-        threads = []
+        if concurrency < 1:
+            return
+        self.done.clear()
+        self.running = concurrency
         for _ in xrange(concurrency):
             t = threading.Thread(target=self.thread)
             t.daemon = True
             t.start()
-            threads.append(t)
-
-        while True:
-            # join() but allow CTRL-C
-            active = False
-            for t in threads:
-                active = active or t.is_alive()
-            if not active:
-                break
-            time.sleep(0.2)
+        # wait() without a timeout would block CTRL-C
+        while not self.done.wait(3600):
+            pass
 
     def thread(self):
-        while not self.queue.empty():
-            func, args, kwargs = self.queue.get_nowait()
-            func(*args, **kwargs)
+        try:
+            while True:
+                with self.lock:
+                    if not self.queue:
+                        return
+                    _, _, func, args, kwargs = heapq.heappop(self.queue)
+                try:
+                    func(*args, **kwargs)
+                except Exception:
+                    traceback.print_exc()
+                    with self.lock:
+                        self.errors.append(sys.exc_info()[1])
+        finally:
+            with self.lock:
+                self.running -= 1
+                if self.running == 0:
+                    self.done.set()
 
 class Flag(object):
     def __init__(self, value=False):
@@ -40,3 +69,44 @@ class Flag(object):
         with self.lock:
             self.value = value
 
+class ProcessPool(object):
+    """
+    Runs CPU-bound functions in worker processes so they don't contend for
+    the GIL with the test threads. With no processes, functions run inline.
+    """
+    def __init__(self, processes=0):
+        self.processes = processes
+        if processes > 0:
+            self.pool = multiprocessing.Pool(processes)
+        else:
+            self.pool = None
+
+    def apply(self, func, *args):
+        return self.apply_async(func, *args).get()
+
+    def apply_async(self, func, *args):
+        "Start running func and return an object whose get() returns or raises its outcome"
+        if self.pool is None:
+            return InlineResult(func, *args)
+        return self.pool.apply_async(func, args)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+class InlineResult(object):
+    def __init__(self, func, *args):
+        try:
+            self.value = func(*args)
+            self.exc_info = None
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+    def ready(self):
+        return True
+
+    def get(self):
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
@@ -0,0 +1,196 @@
+# Copyright (c) 2013 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Where a run spends its time. Each test runs in its own thread, so the
+# test (and step) being timed is thread-local; timings recorded outside of
+# a test, or when no report was asked for, are dropped.
+#
+# Kinds of time recorded: queue wait, navigate, sleep (or wait with
+# --fast), click, key, lock wait, capture, comparison wait, decode,
+# compare and diff write. Steps are labelled by their position in
+# record.json, and a test's timings are summed over every pass it makes
+# (i.e. a rerecord and the playback that confirms it).
+
+import collections
+import contextlib
+import json
+import threading
+import time
+from xml.etree import ElementTree
+
+_local = threading.local()
+
+
+def record(kind, seconds, label=None):
+    test = getattr(_local, 'test', None)
+    if test is not None:
+        test.add(kind, seconds, label or getattr(_local, 'step', None))
+
+
+@contextlib.contextmanager
+def timed(kind, label=None):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(kind, time.time() - start, label)
+
+
+@contextlib.contextmanager
+def step(label):
+    "Attribute everything recorded in a with block to the step with this label"
+    previous = getattr(_local, 'step', None)
+    _local.step = label
+    try:
+        yield
+    finally:
+        _local.step = previous
+
+
+def current_step():
+    return getattr(_local, 'step', None)
+
+
+class TestTimings(object):
+    def __init__(self, file, name, queue_wait):
+        self.file = file
+        self.name = name
+        self.result = None
+        self.message = None
+        self.start = time.time()
+        self.duration = 0.0
+        self.totals = collections.defaultdict(float)
+        self.totals['queue wait'] = queue_wait
+        self.steps = collections.OrderedDict()
+
+    def add(self, kind, seconds, label=None):
+        self.totals[kind] += seconds
+        if label is not None:
+            self.steps.setdefault(label, collections.defaultdict(float))[kind] += seconds
+
+    def to_dict(self):
+        return collections.OrderedDict([
+            ('file', self.file),
+            ('name', self.name),
+            ('result', self.result),
+            ('message', self.message),
+            ('seconds', self.duration),
+            ('totals', dict(self.totals)),
+            ('steps', [
+                collections.OrderedDict([('step', label), ('seconds', sum(kinds.values()))] + sorted(kinds.items()))
+                for label, kinds in self.steps.items()
+            ])
+        ])
+
+
+class Report(object):
+    """
+    Timings for every test in a run, written out as JSON or JUnit XML. A
+    report from one shard of a run (see huxley.shards) records which.
+    """
+    def __init__(self, shard=None):
+        self.shard = shard
+        self.lock = threading.Lock()
+        self.tests = []
+        self.start = time.time()
+
+    def start_test(self, file, name, queue_wait=0.0):
+        test = TestTimings(file, name, queue_wait)
+        with self.lock:
+            self.tests.append(test)
+        _local.test = test
+        _local.step = None
+        return test
+
+    def finish_test(self, result, message=None):
+        test = _local.test
+        test.result = result
+        test.message = message
+        test.duration = time.time() - test.start
+        _local.test = None
+
+    def to_dict(self):
+        with self.lock:
+            tests = list(self.tests)
+        totals = collections.defaultdict(float)
+        for test in tests:
+            for kind, seconds in test.totals.items():
+                totals[kind] += seconds
+        report = collections.OrderedDict([
+            ('seconds', time.time() - self.start),
+            ('totals', dict(totals)),
+            ('tests', [test.to_dict() for test in tests])
+        ])
+        if self.shard:
+            report['shard'] = list(self.shard)
+        return report
+
+
+def write_json(report, path):
+    with open(path, 'w') as f:
+        f.write(json.dumps(report, indent=2))
+
+
+def write_junit(report, path):
+    tests = report['tests']
+    suite = ElementTree.Element('testsuite', {
+        'name': 'huxley',
+        'tests': str(len(tests)),
+        'failures': str(len([t for t in tests if t['result'] not in ('passed', 'skipped', 'error')])),
+        'errors': str(len([t for t in tests if t['result'] == 'error'])),
+        'skipped': str(len([t for t in tests if t['result'] == 'skipped'])),
+        'time': '%.3f' % report['seconds']
+    })
+    for test in tests:
+        case = ElementTree.SubElement(suite, 'testcase', {
+            'classname': test['file'],
+            'name': test['name'],
+            'time': '%.3f' % test['seconds']
+        })
+        if test['result'] == 'skipped':
+            ElementTree.SubElement(case, 'skipped')
+        elif test['result'] == 'error':
+            ElementTree.SubElement(case, 'error', {'message': 'Test raised an exception'})
+        elif test['result'] != 'passed':
+            ElementTree.SubElement(case, 'failure', {'message': test.get('message') or test['result']})
+        ElementTree.SubElement(case, 'system-out').text = '\n'.join(
+            '%s: %.3fs' % (kind, seconds) for kind, seconds in sorted(test['totals'].items())
+        )
+    ElementTree.ElementTree(suite).write(path, encoding='utf-8')
+
+
+def write(report, path):
+    "Write JUnit XML if path ends in .xml, and JSON otherwise"
+    if path.endswith('.xml'):
+        write_junit(report, path)
+    else:
+        write_json(report, path)
+
+
+def print_summary(report, count=5):
+    tests = sorted(report['tests'], key=lambda t: t['seconds'], reverse=True)
+    steps = sorted(
+        ((step['seconds'], test['name'], step['step']) for test in tests for step in test['steps']),
+        reverse=True
+    )
+    print 'Time spent: ' + ', '.join(
+        '%s %.2fs' % (kind, seconds)
+        for kind, seconds in sorted(report['totals'].items(), key=lambda item: item[1], reverse=True)
+    )
+    print 'Slowest tests:'
+    for test in tests[:count]:
+        print '  %8.2fs  %s (%s)' % (test['seconds'], test['name'], test['result'])
+    print 'Slowest steps:'
+    for seconds, name, label in steps[:count]:
+        print '  %8.2fs  %s: %s' % (seconds, name, label)
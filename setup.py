@@ -12,13 +12,14 @@ setup(
     install_requires = [
         'selenium==2.35.0',
         'plac==0.9.1',
-        'Pillow==2.2.1',
-        'jsonpickle==0.4.0'
+        'Pillow==2.2.1'
     ],
     package_data={'': ['requirements.txt']},
     entry_points = {
         'console_scripts': [
-            'huxley=huxley.cmdline:main'
+            'huxley=huxley.cmdline:main',
+            'huxley-merge=huxley.shards:main',
+            'huxley-store=huxley.store:main'
         ]
     },
     author = 'Pete Hunt',